@@ -1,128 +1,544 @@
+import json
 import random
-import copy
-from runner import Board, Piece
+import time
+from engine import NUM_CELLS, NUM_PIECES, cell_position
+from evaluate import EVALUATION_VERSION, evaluate
+from tablebase import EndgameSolver
+from symmetry import canonical_transform, from_canonical_cell, from_canonical_piece, to_canonical_cell, to_canonical_piece
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from profiling import profile_call
+
+# A win found with d plies of search left scores WIN_SCORE + d, so quicker
+# wins (and slower losses) are preferred
+WIN_SCORE = 1000
+INFINITY = 1 << 20
+# ponder() gives up after this many time budgets, so a game left mid-turn
+# doesn't keep a core busy
+PONDER_BUDGETS = 5
+
+
+class SearchTimeout(Exception):
+    # Raised inside the search when the time budget runs out or stop() is called
+    pass
+
+
+class SearchCancelled(Exception):
+    # Raised out of a search that was stopped; there is no answer to use
+    pass
 
 
 class QuartoAI:
-    def __init__(self, max_depth = 3):
-        # Initialize AI with maximum depth for minimax algorithm
+    def __init__(self, max_depth = 3, table_size = 1 << 18, time_budget = None, endgame_empties = None, tablebase = None,
+                 book = None, cache = None, trace = None, profile = None):
+        # max_depth counts plies, where one ply is placing the piece in hand
+        # and then giving the opponent a piece
         self.max_depth = max_depth
+        # With a time budget (seconds per move) the search deepens one ply at
+        # a time up to max_depth and answers with the deepest finished result
+        self.time_budget = time_budget
+        self.deadline = None
+        # Set from another thread to abandon the running search
+        self.stopped = False
+        # Search results shared between symmetric positions (see symmetry.py)
+        self.table = TranspositionTable(table_size)
+        # Positions with at most endgame_empties empty cells are solved exactly,
+        # looking them up in the tablebase first when one is given
+        self.endgame_empties = endgame_empties
+        self.solver = None
+        if endgame_empties is not None:
+            self.solver = EndgameSolver(tablebase, table_size, check=self._check_stop)
+        # Opening positions are answered from the book (see book.py) when given
+        self.book = book
+        # Finished root searches are shared through a ResultCache (see cache.py)
+        self.cache = cache
+        # Move ordering: two killer moves per ply plus a history score per move.
+        # Inside the search a move is the int cell << 4 | give, which is also
+        # its history index, so ordering moves allocates nothing per move.
+        self.killers = [[None, None] for _ in range(NUM_CELLS + 1)]
+        self.history = [0] * (NUM_CELLS * NUM_PIECES)
+        self.nodes = 0
+        self.root_move = None
+        self.root_score = None
+        # Depth the time budget last reached; a root already searched that
+        # deep, e.g. by ponder(), is answered without spending the budget
+        self.budget_depth = None
+        # Counters of the last search (see _record_stats), kept cheap enough
+        # to always run
+        self.evaluations = 0
+        self.cutoffs = 0
+        self.expansions = 0
+        self.moves_generated = 0
+        self.placements_checked = 0
+        self.table_probes = 0
+        self.table_hits = 0
+        self.iterations = []
+        self.root_moves = []
+        # Depth reached, nodes, time and the counters above for the last search
+        self.last_stats = None
+        # Optional extras per search: a JSON line appended to the trace file,
+        # and a profile ("cprofile" or "sample", see profiling.py) whose
+        # report is kept in last_profile
+        self.trace = trace
+        self.profile = profile
+        self.last_profile = None
+        # (occupied, placed, give) planned by the last get_best_move
+        self.planned = None
+        # Depth reached and nodes of the last ponder()
+        self.ponder_stats = None
+
+    def choose_piece(self, available_pieces, board = None):
+        # The search that placed our last piece already picked what to give
+        if self.planned is not None and board is not None:
+            occupied, placed, give = self.planned
+            if board.occupied == occupied and board.placed == placed and give in available_pieces:
+                return give
+        if board is None or board.filled == 0:
+            # Every piece is equivalent on an empty board
+            return random.choice(available_pieces)
+        if self.book is not None:
+            give = self.book.lookup(board)
+            if give in available_pieces:
+                return give
+        return self.search_give(board, available_pieces)[1]
 
-    def choose_piece(self, available_pieces):
-        # Randomly select a piece for the opponent
-        return random.choice(available_pieces)
-    
     def get_best_move(self, board, piece):
-        # Initialize best scores as negative infinity and best move as None
-        best_score = float('-inf')
-        best_move = None
+        move = None
+        if self.book is not None:
+            move = self.book.lookup(board, piece)
+        if move is not None:
+            cell, give = move
+        else:
+            score, (cell, give) = self.search(board, piece)
+        self.planned = (board.occupied | (1 << cell), board.placed | (1 << piece), give)
+        return cell_position(cell)
+
+    def search(self, board, piece, depth = None):
+        # Returns (score, (cell, give)) for the player about to place piece;
+        # give is None when the placement ends the game
+        def run(depth):
+            self.root_move = None
+            score = self._negamax(board, piece, depth, -INFINITY, INFINITY, 0)
+            return score, self.root_move
+        return self._run_search(board, piece, run, depth)
+
+    def search_give(self, board, available_pieces, depth = None):
+        # Pick the piece to hand over when there is nothing to place first
+        poison = board.winning_pieces()
+        # Pieces the opponent can win with right away lose outright, so they
+        # are only searched when there is nothing else to give
+        gives = board.safe_pieces(available_pieces) or list(available_pieces)
+
+        def run(depth):
+            # The previous iteration's best give is searched first
+            ordered = gives
+            if self.root_move is not None:
+                ordered = [self.root_move] + [give for give in gives if give != self.root_move]
+            self.root_move = None
+            best_score = -INFINITY
+            for give in ordered:
+                if (poison >> give) & 1:
+                    score = -(WIN_SCORE + depth)
+                else:
+                    score = -self._negamax(board, give, depth, -INFINITY, -best_score, 1)
+                if score > best_score:
+                    best_score = score
+                    self.root_move = give
+                    self.root_score = score
+            return best_score, self.root_move
+        return self._run_search(board, None, run, depth)
 
-        # Try each possible move on the board
-        for row in range(4):
-            for col in range(4):
-                # Check if the cell is empty
-                if board[row][col] is None:
-                    # Create a deep copy of the board for simulation
-                    board_copy = self._copy_board(board)
-                    # Make the move on the copied board
-                    board_copy.place_piece(piece, row, col)
-
-
-                    # Calculate score using minimax
-                    score = self._minimax(board_copy, self.max_depth, False)
-
-                    # Update best move if current score is better
-                    if score > best_score:
-                        best_score = score
-                        best_move = (row, col)
-        return best_move
-    
-    def _minimax(self, board, depth, is_maximizing):
-        # Base case: check if game is over or maximum depth reached
-        if board.check_win():
-            return 100 if is_maximizing else -100
-        if board.is_full() or depth == 0:
-            return self._evaluate_board(board)
-        
-        if is_maximizing:
-            #Maximizing player's turn
-            max_eval = float('-inf')
-            for row in range(4):
-                for col in range(4):
-                    if board[row][col] is None:
-                        #Try each possible move
-                        board_copy = self._copy_board(board)
-                        # Simulate a random piece placement (since actual piece isn't known)
-                        dummy_piece = self._create_dummy_piece()
-                        board_copy.place_piece(dummy_piece, row, col)
-                        eval = self._minimax(board_copy, depth- 1, False)
-                        max_eval = max(max_eval, eval)
-                    
-
-            return max_eval
+    def ponder(self, board, piece = None, available_pieces = None):
+        # Search the opponent's turn until stop() is called: their placement
+        # of piece and the piece they then give us, or with no piece just the
+        # piece they give from available_pieces. Each reply is one of our
+        # next root positions and is searched as one. A one-ply round over
+        # all of them finds the opponent's best replies; those are then
+        # searched one at a time as deep as our timed search last got
+        # (budget_depth), since a reply pondered any shallower saves nothing.
+        # The table keeps the results, so the real search on a pondered reply
+        # answers at once. Pondering stops by itself once every reply is done
+        # or after PONDER_BUDGETS time budgets.
+        self.stopped = False
+        self._new_search()
+        start = time.perf_counter()
+        filled = board.filled
+        if piece is None:
+            replies = [(None, give) for give in board.safe_pieces(available_pieces)]
         else:
-            #Minimizing player's turn
-            min_eval = float('inf')
-            for row in range(4):
-                for col in range(4):
-                    if board[row][col] is None:
-                        #Try each possible move
-                        board_copy = self._copy_board(board)
-                        # Simulate a random piece placement
-                        dummy_piece = self._create_dummy_piece()
-                        board_copy.place_piece(dummy_piece, row, col)
-                        eval = self._minimax(board_copy, depth- 1, True)
-                        min_eval = min(min_eval, eval)
-            return min_eval
-    
-    def _evaluate_board(self, board):
-        # Count potential winning lines and return a score
-        score = 0
-
-        # Check rows
-        for row in board.grid:
-            score += self._evaluate_line(row)
-
-        # Check col
-        for col in range(4):
-            column = [board.grid[row][col] for row in range(4)]
-            score += self._evaluate_line(column)
-
-        # Check diagonals
-        diag1 = [board.grid[i][i] for i in range(4)]
-        diag2 = [board.grid[i][3-i] for i in range(4)]
-        score += self._evaluate_line(diag1)
-        score += self._evaluate_line(diag2)
-        
+            replies = [(move >> 4, move & 15) for move in board.safe_moves(piece)]
+        target = min(self.budget_depth or self.max_depth, self.max_depth, NUM_CELLS - board.filled)
+        if self.time_budget is not None:
+            self.deadline = start + PONDER_BUDGETS * self.time_budget
+        pondered = 0
+        scores = {}
+        try:
+            for reply in replies:
+                scores[reply] = self._ponder_reply(board, piece, reply, 1)
+            # Our lowest scores are the opponent's best replies
+            replies.sort(key=lambda reply: scores[reply])
+            for reply in replies:
+                for depth in range(2, target + 1):
+                    self._ponder_reply(board, piece, reply, depth)
+                pondered += 1
+        except SearchTimeout:
+            self._unwind(board, filled)
+        finally:
+            self.deadline = None
+        self.ponder_stats = {
+            'depth': target,
+            'replies': len(replies),
+            'pondered': pondered,
+            'nodes': self.nodes,
+            'time': time.perf_counter() - start,
+        }
+
+    def _ponder_reply(self, board, piece, reply, depth):
+        cell, give = reply
+        if cell is not None:
+            board.place(piece, cell)
+        score = self._negamax(board, give, depth, -INFINITY, INFINITY, 0)
+        if cell is not None:
+            board.undo()
         return score
-    
-    def _evaluate_line(self, line):
-        # Count matching attributes in a line
-        if None in line or any(piece is None for piece in line):
+
+    def stop(self):
+        # Ask a search running on another thread to give up; it raises
+        # SearchCancelled. The next search starts normally.
+        self.stopped = True
+
+    def clear(self):
+        # Forget everything earlier searches learned (table, move ordering,
+        # planned give), so the next answer only depends on its position
+        self.table.clear()
+        self.history = [0] * (NUM_CELLS * NUM_PIECES)
+        self.planned = None
+        self.budget_depth = None
+
+    def _run_search(self, board, piece, run, depth):
+        # piece is None when run() searches the piece to give
+        if self.profile is None:
+            result = self._deepen(board, piece, run, depth)
+        else:
+            result, self.last_profile = profile_call(self.profile, self._deepen, board, piece, run, depth)
+        if self.trace is not None:
+            self._write_trace(board, piece, result)
+        return result
+
+    def _deepen(self, board, piece, run, depth):
+        self.stopped = False
+        self._new_search()
+        start = time.perf_counter()
+        filled = board.filled
+        uncached = run
+        if self.cache is not None:
+            run = lambda depth: self._cached_search(board, piece, uncached, depth)
+        if depth is not None or self.time_budget is None:
+            depth = depth or self.max_depth
+            try:
+                result = run(depth)
+                self._record_iteration(depth, start)
+            except SearchTimeout:
+                self._unwind(board, filled)
+                raise SearchCancelled from None
+            self._record_stats(depth, result[0], start)
+            return result
+
+        # Iterative deepening: every iteration starts from the previous best
+        # move (it is the table hint at the root) and a timeout keeps the
+        # deepest finished answer. The deadline holds from the start, since
+        # even the first iteration can reach the endgame solver.
+        result = None
+        completed = 0
+        self.deadline = start + self.time_budget
+        try:
+            depth = 0
+            while depth < self.max_depth:
+                # Iterations the table already holds (see ponder()) are skipped
+                depth = max(depth + 1, min(self._searched_depth(board, piece), self.max_depth))
+                nodes = self.nodes
+                result = run(depth)
+                self._record_iteration(depth, start)
+                completed = depth
+                if abs(result[0]) >= WIN_SCORE or depth >= NUM_CELLS - board.filled or self._solved(board):
+                    # Proven result or searched to the end of the game
+                    break
+                if self.nodes - nodes <= 1 and self.budget_depth is not None and depth >= self.budget_depth:
+                    # Answered from the table as deep as the budget would go
+                    break
+                if time.perf_counter() >= self.deadline:
+                    self.budget_depth = completed
+                    break
+        except SearchTimeout:
+            self._unwind(board, filled)
+            if self.stopped:
+                raise SearchCancelled from None
+            self.budget_depth = completed
+            if self.root_move is not None and completed:
+                # A root move finished in the interrupted iteration and beat
+                # everything searched before it, including the previous best
+                result = (self.root_score, self.root_move)
+        finally:
+            self.deadline = None
+        if result is None:
+            # Not even the first iteration finished: the solver couldn't
+            # prove this position in time. Answer from a one-ply search on the
+            # evaluation alone, which takes a few hundred nodes.
+            result = self._shallow_search(uncached)
+        self._record_stats(completed, result[0], start)
+        return result
+
+    def _shallow_search(self, run):
+        solver, self.solver = self.solver, None
+        try:
+            result = run(1)
+        finally:
+            self.solver = solver
+        # Its table entries score solvable positions heuristically, which a
+        # search with the solver must not mistake for its own
+        self.table.clear()
+        return result
+
+    def _cached_search(self, board, piece, run, depth):
+        # run(depth), answered from the shared cache when this position has
+        # been searched to this depth before. The result is the same either
+        # way: a search's value depends only on the position and depth.
+        key, sym = canonical_transform(board, piece)
+        # Scores depend on the leaf evaluation as well as on endgame solving
+        variant = (EVALUATION_VERSION << 8) | (255 if self.endgame_empties is None else self.endgame_empties)
+        entry = self.cache.get(key, depth, variant)
+        if entry is not None:
+            score, cell, give = entry
+            self.root_score = score
+            if piece is None:
+                self.root_move = from_canonical_piece(sym, give)
+                return score, self.root_move
+            if give is not None:
+                # Seeds the next iteration's move ordering
+                self.table.store(key, depth, EXACT, score, (cell, give))
+            self.root_move = (from_canonical_cell(sym, cell), None if give is None else from_canonical_piece(sym, give))
+            return score, self.root_move
+        start = time.perf_counter()
+        score, move = run(depth)
+        if piece is None:
+            cell, give = None, move
+        else:
+            cell, give = move
+        self.cache.put(key, depth, score,
+                       None if cell is None else to_canonical_cell(sym, cell),
+                       None if give is None else to_canonical_piece(sym, give),
+                       time.perf_counter() - start, variant)
+        return score, move
+
+    def _searched_depth(self, board, piece):
+        # Depth of an exact result for this root already in the table, or 0
+        if piece is None:
             return 0
-            
-        score = 0
-        attributes = ['pastry_type', 'flavor', 'collection', 'topping']
-        
-        for attr in attributes:
-            if all(getattr(piece, attr) == getattr(line[0], attr) for piece in line):
-                score += 1
-                
-        return score
-    
-    def _copy_board(self, board):
-        # Create a deep copy of the board
-        new_board = Board()
-        for i in range(4):
-            for j in range(4):
-                new_board.grid[i][j] = board.grid[i][j]
-        return new_board
-    
-    def _create_dummy_piece(self):
-        # Create a dummy piece for simulation purposes
-        return Piece(
-            random.choice(['Croissant', 'Eclair']),
-            random.choice(['Strawberry', 'Matcha']),
-            random.choice(['Traditional', 'Indulging']),
-            random.choice(['PowderSugar', 'WhippedCream'])
-        )
\ No newline at end of file
+        entry = self.table.probe(canonical_transform(board, piece)[0])
+        if entry is None or entry[2] != EXACT or entry[4] is None:
+            return 0
+        return entry[1]
+
+    def _solved(self, board):
+        # Positions this close to the end are handed to the exact solver
+        return self.solver is not None and NUM_CELLS - board.filled <= self.endgame_empties
+
+    def _check_stop(self):
+        if self._should_stop():
+            raise SearchTimeout
+
+    def _should_stop(self):
+        # Polled every 256 nodes
+        return self.stopped or (self.deadline is not None and time.perf_counter() >= self.deadline)
+
+    def _unwind(self, board, filled):
+        # Take back the placements an interrupted search left on the board
+        while board.filled > filled:
+            board.undo()
+
+    def _record_iteration(self, depth, start):
+        # Nodes and time of one finished iteration of the search
+        nodes = self.nodes - sum(iteration['nodes'] for iteration in self.iterations)
+        self.iterations.append({'depth': depth, 'nodes': nodes, 'time': time.perf_counter() - start})
+
+    def _record_stats(self, depth, score, start):
+        probes = self.table.probes - self.table_probes
+        hits = self.table.hits - self.table_hits
+        # Effective branching factor: how many times more nodes each
+        # iteration took than the one before
+        for previous, iteration in zip(self.iterations, self.iterations[1:]):
+            iteration['ebf'] = iteration['nodes'] / previous['nodes'] if previous['nodes'] else None
+        self.last_stats = {
+            'depth': depth,
+            'nodes': self.nodes,
+            'time': time.perf_counter() - start,
+            'score': score,
+            'evaluations': self.evaluations,
+            # Every node checks for a win, and so does every placement tried
+            # while ordering moves
+            'win_checks': self.nodes + self.placements_checked,
+            'table_probes': probes,
+            'table_hits': hits,
+            'table_hit_rate': hits / probes if probes else 0.0,
+            'cutoffs': self.cutoffs,
+            # Moves generated per expanded node
+            'branching': self.moves_generated / self.expansions if self.expansions else 0.0,
+            'iterations': self.iterations,
+            # Root moves of the last finished iteration, in search order
+            'root_moves': self.root_moves,
+        }
+
+    def _write_trace(self, board, piece, result):
+        record = {
+            'time': time.time(),
+            'cells': [board.piece_at_cell(cell) for cell in range(NUM_CELLS)],
+            'piece': piece,
+            'score': result[0],
+            'move': result[1],
+            'stats': self.last_stats,
+        }
+        if self.profile is not None:
+            record['profile'] = self.last_profile
+        with open(self.trace, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _new_search(self):
+        self.table.new_search()
+        self.nodes = 0
+        self.evaluations = 0
+        self.cutoffs = 0
+        self.expansions = 0
+        self.moves_generated = 0
+        self.placements_checked = 0
+        self.iterations = []
+        self.root_moves = []
+        self.table_probes = self.table.probes
+        self.table_hits = self.table.hits
+        self.root_move = None
+        self.killers = [[None, None] for _ in range(NUM_CELLS + 1)]
+        # Older history counts fade so the current position dominates ordering
+        self.history = [h >> 2 for h in self.history]
+
+    def _negamax(self, board, piece, depth, alpha, beta, ply):
+        # Score for the player who has to place piece on board
+        self.nodes += 1
+        if not self.nodes & 255 and self._should_stop():
+            raise SearchTimeout
+        cell = board.winning_cell(piece)
+        if cell is not None:
+            if ply == 0:
+                self.root_move = (cell, None)
+                self.root_score = WIN_SCORE + depth
+            return WIN_SCORE + depth
+        if board.filled == NUM_CELLS - 1:
+            # The last piece goes in the last cell without winning
+            if ply == 0:
+                self.root_move = (board.empty_cells()[0], None)
+                self.root_score = 0
+            return 0
+        if self._solved(board):
+            if ply == 0:
+                value, self.root_move = self.solver.best_move(board, piece)
+                self.root_score = value * (WIN_SCORE + depth)
+                return self.root_score
+            return self.solver.solve(board, piece) * (WIN_SCORE + depth)
+        if depth == 0:
+            self.evaluations += 1
+            return evaluate(board)
+
+        alpha_orig = alpha
+        key, sym = canonical_transform(board, piece)
+        entry = self.table.probe(key)
+        hint = None
+        if entry is not None:
+            if entry[4] is not None:
+                hint = from_canonical_cell(sym, entry[4][0]) << 4 | from_canonical_piece(sym, entry[4][1])
+            if entry[1] == depth:
+                flag, score = entry[2], entry[3]
+                if ply == 0:
+                    # This root was already searched to this depth, e.g. by
+                    # ponder(); an exact entry holds its best move too
+                    if flag == EXACT and hint is not None:
+                        self.root_move = (hint >> 4, hint & 15)
+                        self.root_score = score
+                        return score
+                elif flag == EXACT or (flag == LOWER and score >= beta) or (flag == UPPER and score <= alpha):
+                    return score
+
+        moves = self._order_moves(board, piece, ply, hint)
+        if not moves:
+            # Every placement leaves only pieces the opponent wins with
+            cell = board.empty_cells()[0]
+            board.place(piece, cell)
+            give = board.remaining_pieces()[0]
+            board.undo()
+            if ply == 0:
+                self.root_move = (cell, give)
+                self.root_score = -(WIN_SCORE + depth - 1)
+            return -(WIN_SCORE + depth - 1)
+
+        best_score = -INFINITY
+        best_move = None
+        if ply == 0:
+            self.root_moves = []
+        for move in moves:
+            cell = move >> 4
+            give = move & 15
+            if ply == 0:
+                move_start = time.perf_counter()
+                move_nodes = self.nodes
+            board.place(piece, cell)
+            score = -self._negamax(board, give, depth - 1, -beta, -alpha, ply + 1)
+            board.undo()
+            if ply == 0:
+                self.root_moves.append({'cell': cell, 'give': give, 'score': score, 'nodes': self.nodes - move_nodes,
+                                        'time': time.perf_counter() - move_start})
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if ply == 0:
+                    self.root_move = (cell, give)
+                    self.root_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        self._record_cutoff(move, depth, ply)
+                        break
+
+        if best_score <= alpha_orig:
+            flag = UPPER
+        elif best_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        canonical_move = (to_canonical_cell(sym, best_move >> 4), to_canonical_piece(sym, best_move & 15))
+        self.table.store(key, depth, flag, best_score, canonical_move)
+        return best_score
+
+    def _order_moves(self, board, piece, ply, hint):
+        # All moves (cell << 4 | give) that don't hand the opponent an
+        # immediate win, best candidates first: table hint, killer moves, then
+        # history score. Moves are small ints, so the list is all that's built.
+        moves = board.safe_moves(piece)
+        self.expansions += 1
+        self.placements_checked += NUM_CELLS - board.filled
+        self.moves_generated += len(moves)
+        # The sort is stable, so equal history keeps the moves in cell order
+        moves.sort(key=self.history.__getitem__, reverse=True)
+        killers = self.killers[ply]
+        for move in (killers[1], killers[0], hint):
+            if move is not None and move in moves:
+                moves.remove(move)
+                moves.insert(0, move)
+        return moves
+
+    def _record_cutoff(self, move, depth, ply):
+        self.cutoffs += 1
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        self.history[move] += depth * depth
+
+    def table_stats(self):
+        # Hit rate and fill of the transposition table
+        return self.table.stats()
@@ -1,13 +1,17 @@
+import io
+import os
+
 import pygame
 import pygame.freetype
 
+from engine import piece_name
+
 # Window settings
 WINDOW_SIZE = (1200, 800)
-BOARD_SIZE = 4
-CELL_SIZE = 140  
-PIECE_SIZE = 120  
+CELL_SIZE = 140
+PIECE_SIZE = 120
 MARGIN = 50
-PIECE_SELECTION_SIZE = 80  
+PIECE_SELECTION_SIZE = 80
 
 # Colors
 WHITE = (255, 255, 255)
@@ -22,20 +26,61 @@ TUSCAN_RED = (137, 29, 26)
 CREAMY_BISCOTTI = (241, 230, 210)
 OLIVEWOOD = (33, 7, 6)
 
-# Initialize Pygame and fonts
-pygame.init()
-pygame.freetype.init()
+# Assets live next to this file, wherever the game is started from
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_PATH = os.path.join(ASSET_DIR, "font", "RozhaOne-Regular.ttf")
+
+# Nothing is loaded at import: each asset is read on first use and kept, so
+# headless code importing the UI never touches SDL or decodes an image
+_fonts = {}
+_images = {}
+# Pre-baked assets (see assets.py) used instead of the files when set
+_bundle = None
+
+
+def use_bundle(bundle):
+    # bundle is an AssetBundle, or None to go back to the files
+    global _bundle
+    _bundle = bundle
+    _fonts.clear()
+    _images.clear()
+
+
+def font(size):
+    if size not in _fonts:
+        pygame.freetype.init()
+        data = _bundle.file_data(FONT_PATH) if _bundle is not None else None
+        _fonts[size] = pygame.freetype.Font(FONT_PATH if data is None else io.BytesIO(data), size)
+    return _fonts[size]
+
+
+def title_font():
+    return font(48)
+
+
+def prompt_font():
+    return font(24)
+
+
+def button_font():
+    return font(32)
+
 
-# Load fonts
-TITLE_FONT = pygame.freetype.Font("assets/font/RozhaOne-Regular.ttf", 48)
-PROMPT_FONT = pygame.freetype.Font("assets/font/RozhaOne-Regular.ttf", 24)
+def image(name, size = None):
+    # name is relative to ASSET_DIR, e.g. "bg/2.png"; scaled to size if given
+    key = (name, size)
+    if key not in _images and _bundle is not None:
+        baked = _bundle.image(name, size)
+        if baked is not None:
+            _images[key] = baked
+    if key not in _images:
+        if (name, None) not in _images:
+            _images[(name, None)] = pygame.image.load(os.path.join(ASSET_DIR, name))
+        _images[key] = _images[(name, None)]
+        if size is not None:
+            _images[key] = pygame.transform.scale(_images[key], size)
+    return _images[key]
 
-# Load background
-BACKGROUND_IMG = pygame.image.load('assets/bg/2.png')
-BACKGROUND_IMG = pygame.transform.scale(BACKGROUND_IMG, WINDOW_SIZE)
 
-# Game piece attributes
-PASTRY_TYPES = ['Croissant', 'Eclair']
-FLAVORS = ['Strawberry', 'Matcha']
-COLLECTIONS = ['Traditional', 'Indulging']
-TOPPINGS = ['PowderSugar', 'WhippedCream']
\ No newline at end of file
+def pastry_image(piece, size = None):
+    return image(f"pastry/{piece_name(piece)}.png", size)
@@ -0,0 +1,213 @@
+# Headless batch analysis of Quarto positions, for coaching cards and tuning.
+#
+# Reads one position per JSON line:
+#   {"id": "any", "board": [16 piece ids or null, row by row], "piece": 6, "remaining": [...]}
+# board may also be 4 rows of 4. remaining, the pieces left to give once
+# piece is placed, is optional and checked against the board when given; id
+# is copied to the result. Writes one JSON line per position, in input order:
+#   {"line": 1, "id": "any", "cell": 5, "row": 1, "col": 1, "give": 9, "score": 3, "depth": 4, "nodes": 812, "time": 0.01}
+# or {"line": 1, "error": "..."} for a position that can't be analyzed.
+#
+# Positions go to a process pool in chunks, with only a few chunks per worker
+# in flight, so memory stays flat however long the input is. Each chunk's
+# results are flushed as they come in: with --resume the positions already in
+# --out are skipped and the run carries on where it stopped. Ctrl-C stops
+# after the chunk being written, so the file is always ready to resume.
+#
+#   python analyze.py positions.jsonl --engine minimax:time=0.1 --out results.jsonl
+#   python analyze.py positions.jsonl --engine minimax:depth=4 --out results.jsonl --resume
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import Board, BOARD_SIZE, NUM_CELLS, NUM_PIECES, cell_position
+from tournament import make_engine, parse_engine
+
+# State of each pool worker process, set up by _init_worker
+_engine = None
+
+
+def _init_worker(spec):
+    global _engine
+    # Ctrl-C is handled by the main process (see analyze())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _engine = make_engine(spec, 0)
+
+
+def _is_piece_id(value):
+    # JSON true and false load as bools, which Python counts as ints
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < NUM_PIECES
+
+
+def parse_position(record):
+    # (board, piece) from one input record; ValueError when it isn't a
+    # position with a piece to place
+    cells = record.get("board")
+    if isinstance(cells, list) and len(cells) == BOARD_SIZE and all(isinstance(row, list) for row in cells):
+        cells = [piece for row in cells for piece in row]
+    if not isinstance(cells, list) or len(cells) != NUM_CELLS:
+        raise ValueError(f"board must list {NUM_CELLS} cells")
+    board = Board()
+    for cell, piece in enumerate(cells):
+        if piece is None:
+            continue
+        if not _is_piece_id(piece) or (board.placed >> piece) & 1:
+            raise ValueError(f"bad piece {piece!r} in cell {cell}")
+        board.place(piece, cell)
+    piece = record.get("piece")
+    if not _is_piece_id(piece) or (board.placed >> piece) & 1:
+        raise ValueError(f"bad piece to place {piece!r}")
+    if board.check_win() or board.is_full():
+        raise ValueError("the game is already over")
+    remaining = record.get("remaining")
+    if remaining is not None:
+        expected = [int(p) for p in board.remaining_pieces() if p != piece]
+        if not isinstance(remaining, list) or not all(map(_is_piece_id, remaining)) or sorted(remaining) != expected:
+            raise ValueError(f"remaining should be {expected}")
+    return board, piece
+
+
+def analyze_position(ai, board, piece):
+    # The engine's answer for one position, searched from a clean slate so it
+    # doesn't depend on which positions the worker saw before
+    ai.clear()
+    start = time.perf_counter()
+    score, (cell, give) = ai.search(board, piece)
+    elapsed = time.perf_counter() - start
+    row, col = cell_position(cell)
+    return {'cell': cell, 'row': row, 'col': col, 'give': give, 'score': score,
+            'depth': ai.last_stats['depth'], 'nodes': ai.nodes, 'time': round(elapsed, 6)}
+
+
+def analyze_line(ai, number, line):
+    # The result for input line number
+    result = {'line': number}
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+        if "id" in record:
+            result['id'] = record["id"]
+        result.update(analyze_position(ai, *parse_position(record)))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        result['error'] = str(e)
+    return result
+
+
+def _analyze_chunk(chunk):
+    # Runs in a pool worker: chunk is [(line number, line)]. Returns the
+    # output lines and how many of them are errors.
+    results = [analyze_line(_engine, number, line) for number, line in chunk]
+    return [json.dumps(result) for result in results], sum('error' in result for result in results)
+
+
+def read_chunks(lines, chunksize, skip = 0):
+    # Non-blank lines as [(line number, line)] chunks, after the first skip
+    chunk = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        if skip:
+            skip -= 1
+            continue
+        chunk.append((number, line))
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resume_count(path):
+    # Results already in path, dropping a last line cut short by a crash
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r+b") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    return data.count(b"\n", 0, end)
+
+
+def analyze(lines, spec, out, workers, chunksize, skip = 0, progress = None):
+    # Writes a result line to out for every position in lines, in order.
+    # Returns (positions, errors, seconds, interrupted).
+    positions = errors = 0
+    start = time.perf_counter()
+    reported = start
+    # Enough chunks in flight to keep every worker busy, and no more
+    window = workers * 4
+    pending = deque()
+    # A KeyboardInterrupt could land inside the pool's bookkeeping, so Ctrl-C
+    # only sets a flag checked between chunks
+    interrupted = []
+    handler = signal.signal(signal.SIGINT, lambda signum, frame: interrupted.append(signum))
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(spec,))
+    try:
+        chunks = read_chunks(lines, chunksize, skip)
+        while not interrupted:
+            for chunk in chunks:
+                pending.append(pool.submit(_analyze_chunk, chunk))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+            results, chunk_errors = pending.popleft().result()
+            for result in results:
+                out.write(result + "\n")
+            out.flush()
+            positions += len(results)
+            errors += chunk_errors
+            now = time.perf_counter()
+            if progress is not None and now - reported >= 5:
+                reported = now
+                progress.write(f"{skip + positions} positions, {positions / (now - start):.0f}/s\n")
+    finally:
+        pool.shutdown(cancel_futures=True)
+        signal.signal(signal.SIGINT, handler)
+    return positions, errors, time.perf_counter() - start, bool(interrupted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze JSON lines of positions with a worker pool")
+    parser.add_argument("input", help="JSON lines of positions, - for stdin")
+    parser.add_argument("--engine", default="minimax:depth=3",
+                        help="minimax engine spec as in tournament.py; depth= or time= is the per-position budget")
+    parser.add_argument("--out", default="-", help="results file (default: stdout)")
+    parser.add_argument("--resume", action="store_true", help="skip the positions already in --out")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=16, help="positions sent to a worker at a time")
+    args = parser.parse_args()
+
+    if parse_engine(args.engine)[0] != "minimax":
+        parser.error("only minimax engines report scores to analyze with")
+    if args.resume and args.out == "-":
+        parser.error("--resume needs an --out file")
+    skip = resume_count(args.out) if args.resume else 0
+    source = sys.stdin if args.input == "-" else open(args.input)
+    out = sys.stdout if args.out == "-" else open(args.out, "a" if args.resume else "w")
+    try:
+        if skip:
+            print(f"resuming after {skip} positions", file=sys.stderr)
+        positions, errors, elapsed, interrupted = analyze(source, args.engine, out, args.workers, args.chunksize,
+                                                          skip, sys.stderr)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"{args.engine}: {positions} positions in {elapsed:.1f}s "
+          f"({positions / elapsed if elapsed > 0 else 0:.0f}/s), {errors} errors", file=sys.stderr)
+    if interrupted:
+        sys.exit(f"interrupted after {skip + positions} positions; --resume carries on from there")
+
+
+if __name__ == "__main__":
+    main()
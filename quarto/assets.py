@@ -0,0 +1,297 @@
+# Pre-baked asset bundle for the pygame UI.
+# Decoding the PNGs and scaling the backgrounds is most of the game's cold
+# start, so build does it once, offline, and writes BUNDLE_PATH: the
+# backgrounds already scaled to the window, the 16 pastries in one atlas per
+# size they are drawn at, and the UI font. Pixels are raw BGRA, the byte order
+# of the usual 32-bit display format, so converting them for the display is a
+# plain copy. The file is memory-mapped and surfaces are made straight over
+# the mapping, so opening it reads nothing up front.
+#
+#   python assets.py build
+#   python assets.py bench --runs 5
+#
+# A bundle built from different source files or sizes is ignored by
+# open_default(), and the game loads the PNGs as before.
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import time
+
+import pygame
+
+import Quarto
+from Quarto import ASSET_DIR, FONT_PATH, PIECE_SELECTION_SIZE, PIECE_SIZE, WINDOW_SIZE
+from engine import PIECES, piece_name
+
+BUNDLE_PATH = os.path.join(ASSET_DIR, "ui.qab")
+
+# File layout: header, the JSON index, then the pixel and font data, each
+# blob starting on an _ALIGN boundary
+_MAGIC = b"QAB1"
+_HEADER = struct.Struct(">4sI")   # magic, index length
+_ALIGN = 64
+_PIXEL_FORMAT = "BGRA"
+
+BACKGROUNDS = ["bg/1.png", "bg/2.png"]
+# The sizes draw_piece() is called with: board and held piece, then the tray
+PASTRY_SIZES = [PIECE_SIZE, PIECE_SELECTION_SIZE]
+
+
+def _pastry_name(piece):
+    return f"pastry/{piece_name(piece)}.png"
+
+
+def _sources():
+    # Files the bundle is made from, as paths relative to ASSET_DIR
+    return BACKGROUNDS + [_pastry_name(piece) for piece in PIECES] + [os.path.relpath(FONT_PATH, ASSET_DIR)]
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def _signature():
+    # What a bundle must have been built from to be used: the sizes, and the
+    # size and hash of every source file. Contents rather than modification
+    # times, so a bundle still matches after a copy or a checkout.
+    files = {}
+    for name in _sources():
+        path = os.path.join(ASSET_DIR, name)
+        files[name] = [os.path.getsize(path), _file_hash(path)]
+    return {'window': list(WINDOW_SIZE), 'pastry_sizes': PASTRY_SIZES, 'files': files}
+
+
+def _mtimes():
+    return {name: os.stat(os.path.join(ASSET_DIR, name)).st_mtime_ns for name in _sources()}
+
+
+def _is_current(index):
+    # Whether a bundle matches the sources, without _signature()'s cost: a
+    # file with the size and modification time it was built from is taken
+    # as unchanged, and only the others are hashed
+    signature = index['signature']
+    if signature['window'] != list(WINDOW_SIZE) or signature['pastry_sizes'] != PASTRY_SIZES:
+        return False
+    if set(signature['files']) != set(_sources()):
+        return False
+    mtimes = index.get('mtimes', {})
+    for name, (size, digest) in signature['files'].items():
+        path = os.path.join(ASSET_DIR, name)
+        try:
+            stat = os.stat(path)
+            if stat.st_size != size or (stat.st_mtime_ns != mtimes.get(name) and _file_hash(path) != digest):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _image_key(name, size):
+    return f"{name}@{size[0]}x{size[1]}"
+
+
+class AssetBundle:
+    def __init__(self, path = BUNDLE_PATH):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = _HEADER.unpack_from(self.data, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Quarto asset bundle")
+        self.index = json.loads(self.data[_HEADER.size:_HEADER.size + index_length])
+        # Surfaces over the mapping, made on first use
+        self.surfaces = {}
+
+    @classmethod
+    def open_default(cls):
+        # The built bundle, or None when it hasn't been built or its sources
+        # have changed since
+        if not os.path.exists(BUNDLE_PATH):
+            return None
+        bundle = cls(BUNDLE_PATH)
+        if not _is_current(bundle.index):
+            bundle.close()
+            return None
+        return bundle
+
+    def image(self, name, size):
+        # The surface Quarto.image(name, size) would load, or None when the
+        # bundle doesn't have it. It shares the bundle's memory.
+        if size is None:
+            return None
+        entry = self.index['images'].get(_image_key(name, size))
+        if entry is None:
+            return None
+        surface_name, x, y = entry
+        surface = self._surface(surface_name)
+        if surface.get_size() == tuple(size):
+            return surface
+        return surface.subsurface((x, y, size[0], size[1]))
+
+    def file_data(self, path):
+        # Bytes of a bundled file, by its path, or None
+        entry = self.index['files'].get(os.path.relpath(path, ASSET_DIR))
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.data[offset:offset + length]
+
+    def _surface(self, name):
+        surface = self.surfaces.get(name)
+        if surface is None:
+            offset, width, height = self.index['surfaces'][name]
+            pixels = memoryview(self.data)[offset:offset + width * height * 4]
+            surface = pygame.image.frombuffer(pixels, (width, height), _PIXEL_FORMAT)
+            self.surfaces[name] = surface
+        return surface
+
+    def close(self):
+        # Surfaces from image() must not be used after this
+        self.surfaces.clear()
+        self.data.close()
+        self.file.close()
+
+
+def build(path = BUNDLE_PATH):
+    # Renders every asset through Quarto.image(), the same code the game uses
+    # without a bundle, so the bundled pixels are exactly what it would draw.
+    # Written to a temporary file and renamed, so a running game never maps a
+    # half-written bundle.
+    Quarto.use_bundle(None)
+    blobs = []
+    surfaces = {}
+    images = {}
+    for name in BACKGROUNDS:
+        key = _image_key(name, WINDOW_SIZE)
+        surfaces[key] = (len(blobs), WINDOW_SIZE)
+        images[key] = [key, 0, 0]
+        blobs.append(pygame.image.tobytes(Quarto.image(name, WINDOW_SIZE), _PIXEL_FORMAT))
+    for size in PASTRY_SIZES:
+        # One row of pastries per size, in piece order
+        atlas = pygame.Surface((size * len(PIECES), size), pygame.SRCALPHA, 32)
+        for piece in PIECES:
+            atlas.blit(Quarto.pastry_image(piece, (size, size)), (piece * size, 0))
+            images[_image_key(_pastry_name(piece), (size, size))] = [f"pastry@{size}", piece * size, 0]
+        surfaces[f"pastry@{size}"] = (len(blobs), atlas.get_size())
+        blobs.append(pygame.image.tobytes(atlas, _PIXEL_FORMAT))
+    files = {}
+    for name in _sources():
+        if name.endswith(".ttf"):
+            files[name] = len(blobs)
+            with open(os.path.join(ASSET_DIR, name), "rb") as f:
+                blobs.append(f.read())
+
+    # Times first: a source saved during the build then reads as changed
+    mtimes = _mtimes()
+    signature = _signature()
+
+    # Offsets depend on the index length, which depends on the offsets, so
+    # the index is sized with placeholder offsets first
+    def index_for(offsets):
+        return json.dumps({
+            'signature': signature,
+            'mtimes': mtimes,
+            'surfaces': {name: [offsets[blob], size[0], size[1]] for name, (blob, size) in surfaces.items()},
+            'images': images,
+            'files': {name: [offsets[blob], len(blobs[blob])] for name, blob in files.items()},
+        }).encode()
+
+    length = len(index_for([1 << 40] * len(blobs)))
+    offsets = []
+    offset = _HEADER.size + length
+    for blob in blobs:
+        offset = -(-offset // _ALIGN) * _ALIGN
+        offsets.append(offset)
+        offset += len(blob)
+    index = index_for(offsets).ljust(length)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, length))
+        f.write(index)
+        for offset, blob in zip(offsets, blobs):
+            f.write(bytes(offset - f.tell()))
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+def load_startup_assets():
+    # What the game draws in its first frames: both backgrounds, every pastry
+    # at both sizes and the fonts, converted for the display as SpriteCache
+    # does. Returns the number of surfaces.
+    from render import SpriteCache
+
+    sprites = SpriteCache()
+    for name in BACKGROUNDS:
+        sprites.image(name, WINDOW_SIZE)
+    for size in PASTRY_SIZES:
+        for piece in PIECES:
+            sprites.pastry(piece, size)
+    for font in (Quarto.title_font, Quarto.prompt_font, Quarto.button_font):
+        font()
+    return len(sprites.sprites)
+
+
+def _startup(bundled):
+    # One cold start in this process: seconds to open the display and have
+    # every startup asset ready
+    start = time.perf_counter()
+    pygame.display.init()
+    pygame.display.set_mode(WINDOW_SIZE)
+    bundle = AssetBundle.open_default() if bundled else None
+    if bundled and bundle is None:
+        raise SystemExit(f"{BUNDLE_PATH} is missing or out of date; run python assets.py build")
+    Quarto.use_bundle(bundle)
+    load_startup_assets()
+    return time.perf_counter() - start
+
+
+def bench(runs):
+    # Each start runs in a fresh process, so nothing is cached between them
+    # except the OS page cache
+    results = {}
+    for label, flag in [("png", "--no-bundle"), ("bundle", "--bundle")]:
+        times = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "startup", flag],
+                                    capture_output=True, text=True, check=True).stdout
+            times.append(float(output.split()[-1]))
+        results[label] = times
+        print(f"{label:7s} median {statistics.median(times) * 1000:8.1f} ms  "
+              f"min {min(times) * 1000:8.1f} ms  over {runs} starts")
+    print(f"speedup {statistics.median(results['png']) / statistics.median(results['bundle']):.1f}x")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and time the pre-baked UI asset bundle")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="write the bundle")
+    build_parser.add_argument("--out", default=BUNDLE_PATH)
+    bench_parser = commands.add_parser("bench", help="time a cold start with and without the bundle")
+    bench_parser.add_argument("--runs", type=int, default=5)
+    startup_parser = commands.add_parser("startup", help="time one start in this process (used by bench)")
+    startup_parser.add_argument("--bundle", action=argparse.BooleanOptionalAction, default=True)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        size = build(args.out)
+        print(f"{args.out}: {size / (1 << 20):.1f} MiB in {time.perf_counter() - start:.1f}s")
+    elif args.command == "bench":
+        bench(args.runs)
+    else:
+        print(f"{_startup(args.bundle):.6f}")
+
+
+if __name__ == "__main__":
+    main()
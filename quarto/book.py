@@ -0,0 +1,151 @@
+# Opening book for QuartoAI.
+# The first few plies are the widest part of the tree and the same in every
+# game, so they are searched deeply once, offline, and QuartoAI answers them
+# from this file instead. Positions are stored by canonical key (see
+# symmetry.py) with the best move in the canonical frame, as sorted
+# fixed-size records that are memory-mapped and binary searched.
+#
+#   python book.py build --plies 3 --depth 4 --out opening.qbk
+#
+# Two kinds of position are stored: a piece in hand to place (answered with
+# the cell and the piece to give back) and a board with nothing in hand
+# (answered with just the piece to give).
+import argparse
+import mmap
+import os
+import struct
+import time
+
+from engine import Board, NUM_PIECES
+from symmetry import canonical, canonical_transform, decode, from_canonical_cell, from_canonical_piece, to_canonical_cell, to_canonical_piece
+from tablebase import find_record
+
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening.qbk")
+
+# A record is the 16-byte big-endian canonical key, the cell and the piece
+# to give; _NONE stands for "no cell" in give-only records
+_MAGIC = b"QBK1"
+_HEADER = struct.Struct(">4sII")   # magic, record count, plies covered
+_KEY_BYTES = 16
+_RECORD_BYTES = _KEY_BYTES + 2
+_NONE = 255
+
+
+class OpeningBook:
+    def __init__(self, path = BOOK_PATH):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.plies = _HEADER.unpack_from(self.data, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Quarto opening book")
+        self.probes = 0
+        self.hits = 0
+
+    @classmethod
+    def open_default(cls):
+        # The shipped book, or None when it hasn't been built
+        if not os.path.exists(BOOK_PATH):
+            return None
+        return cls(BOOK_PATH)
+
+    def __len__(self):
+        return self.count
+
+    def lookup(self, board, piece = None):
+        # (cell, give) for the player holding piece, or the piece to give
+        # when piece is None; None when the position isn't in the book
+        self.probes += 1
+        key, sym = canonical_transform(board, piece)
+        index = find_record(self.data, _HEADER.size, _RECORD_BYTES, self.count, key.to_bytes(_KEY_BYTES, "big"))
+        if index is None:
+            return None
+        self.hits += 1
+        start = _HEADER.size + index * _RECORD_BYTES + _KEY_BYTES
+        cell, give = self.data[start], self.data[start + 1]
+        give = from_canonical_piece(sym, give)
+        if piece is None:
+            return give
+        return from_canonical_cell(sym, cell), give
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def write_book(path, entries, plies):
+    # entries maps canonical key -> (cell, give) in the canonical frame
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(entries), plies))
+        for key in sorted(entries):
+            cell, give = entries[key]
+            f.write(key.to_bytes(_KEY_BYTES, "big"))
+            f.write(bytes([_NONE if cell is None else cell, give]))
+    os.replace(tmp_path, path)
+
+
+def opening_positions(plies):
+    # Canonical keys of every position in the first plies plies: those with a
+    # piece in hand, and those waiting for a piece to be given
+    placing = set()
+    giving = set()
+    level = {canonical(Board(), 0)}
+    for _ in range(plies):
+        placing |= level
+        next_level = set()
+        for key in level:
+            board, piece = decode(key)
+            for cell in board.empty_cells():
+                board.place(piece, cell)
+                if not board.check_win():
+                    giving.add(canonical(board))
+                    gives = board.safe_gives()
+                    for give in range(NUM_PIECES):
+                        if (gives >> give) & 1:
+                            next_level.add(canonical(board, give))
+                board.undo()
+        level = next_level
+    return placing, giving
+
+
+def build(path, plies, depth):
+    # Imported here so the book module itself stays light for the game
+    from Agent import QuartoAI
+
+    ai = QuartoAI(depth)
+    placing, giving = opening_positions(plies)
+    entries = {}
+    start = time.perf_counter()
+    for key in sorted(placing):
+        board, piece = decode(key)
+        _, (cell, give) = ai.search(board, piece)
+        # The decoded board is in the canonical frame already, but it may be
+        # symmetric, so map the move the same way lookup() will
+        _, sym = canonical_transform(board, piece)
+        entries[key] = (to_canonical_cell(sym, cell), to_canonical_piece(sym, give))
+    for key in sorted(giving):
+        board, _ = decode(key)
+        _, give = ai.search_give(board, board.remaining_pieces())
+        _, sym = canonical_transform(board)
+        entries[key] = (None, to_canonical_piece(sym, give))
+    write_book(path, entries, plies)
+    elapsed = time.perf_counter() - start
+    print(f"searched {len(placing)} placements and {len(giving)} gives at depth {depth} "
+          f"in {elapsed:.1f}s, wrote {len(entries)} positions to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Quarto opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="search the opening positions and write the book")
+    build_parser.add_argument("--plies", type=int, default=3, help="plies from the start covered by the book")
+    build_parser.add_argument("--depth", type=int, default=4, help="search depth per position")
+    build_parser.add_argument("--out", default=BOOK_PATH)
+    args = parser.parse_args()
+    build(args.out, args.plies, args.depth)
+
+
+if __name__ == "__main__":
+    main()
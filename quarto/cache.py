@@ -0,0 +1,217 @@
+# Persistent search results shared by every QuartoAI on a machine.
+# Finished root searches are stored in SQLite by canonical position (see
+# symmetry.py) and depth, so a position searched at one table, or before a
+# restart, is answered at every other table from the cache. WAL mode lets
+# several kiosk and server processes read and write the same file at once.
+# The file is bounded: the least recently used rows are evicted past
+# max_entries. On open the most recently used rows are loaded into memory.
+#
+#   python cache.py stats      hit ratio and search time saved so far
+#   python cache.py clear
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis.sqlite")
+
+_KEY_BYTES = 16
+_default_cache = None
+# Eviction is checked every _EVICT_BATCH writes, and this process's counters
+# are added to the shared totals every _FLUSH_EVERY lookups, along with when
+# each row it hit was last used
+_EVICT_BATCH = 256
+_FLUSH_EVERY = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB NOT NULL,
+    depth INTEGER NOT NULL,
+    variant INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    cell INTEGER,
+    give INTEGER,
+    seconds REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, depth, variant)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+class ResultCache:
+    def __init__(self, path = CACHE_PATH, max_entries = 500000, warm_entries = 20000):
+        self.path = path
+        self.max_entries = max_entries
+        # The AI searches on a worker thread; one connection, used under a lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+        # (key, depth, variant) -> (score, cell, give, seconds), most recent last
+        self.memory = OrderedDict()
+        self.memory_size = warm_entries
+        rows = self.db.execute(
+            "SELECT key, depth, variant, score, cell, give, seconds FROM results ORDER BY last_used DESC LIMIT ?",
+            (warm_entries,)).fetchall()
+        for key, depth, variant, score, cell, give, seconds in reversed(rows):
+            self.memory[(int.from_bytes(key, "big"), depth, variant)] = (score, cell, give, seconds)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.time_saved = 0.0
+        # Counts not yet added to the shared totals in the counters table
+        self._unflushed = [0, 0, 0.0]
+        # (key, depth, variant) -> time of its last hit, not yet written to
+        # last_used; a hit alone writes nothing, so lookups don't queue
+        # behind other processes for the write lock
+        self._used = {}
+
+    @classmethod
+    def open_default(cls):
+        # One shared instance per process on CACHE_PATH, opened on first use
+        global _default_cache
+        if _default_cache is None:
+            _default_cache = cls(CACHE_PATH)
+        return _default_cache
+
+    def get(self, key, depth, variant = 0):
+        # (score, cell, give) in the canonical frame, or None
+        entry_key = (key, depth, variant)
+        with self.lock:
+            entry = self.memory.get(entry_key)
+            if entry is not None:
+                self.memory.move_to_end(entry_key)
+            else:
+                row = self.db.execute(
+                    "SELECT score, cell, give, seconds FROM results WHERE key = ? AND depth = ? AND variant = ?",
+                    (key.to_bytes(_KEY_BYTES, "big"), depth, variant)).fetchone()
+                if row is not None:
+                    entry = tuple(row)
+                    self._remember(entry_key, entry)
+            if not (self.hits + self.misses + 1) % _FLUSH_EVERY:
+                self._flush()
+            if entry is None:
+                self.misses += 1
+                self._unflushed[1] += 1
+                return None
+            self.hits += 1
+            self.time_saved += entry[3]
+            self._unflushed[0] += 1
+            self._unflushed[2] += entry[3]
+            self._used[entry_key] = time.time()
+            return entry[:3]
+
+    def put(self, key, depth, score, cell, give, seconds, variant = 0):
+        # seconds is what the search took, reported as saved on later hits
+        with self.lock:
+            self._remember((key, depth, variant), (score, cell, give, seconds))
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (key.to_bytes(_KEY_BYTES, "big"), depth, variant, score, cell, give, seconds, time.time()))
+            self.writes += 1
+            if self.writes % _EVICT_BATCH == 0:
+                self._evict()
+
+    def _remember(self, entry_key, entry):
+        self.memory[entry_key] = entry
+        self.memory.move_to_end(entry_key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def _evict(self):
+        # Recent hits first, so they count as recent here
+        self._flush()
+        count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.db.execute(
+                "DELETE FROM results WHERE last_used <= (SELECT last_used FROM results ORDER BY last_used LIMIT 1 OFFSET ?)",
+                (excess - 1,))
+
+    def flush_stats(self):
+        # Add this process's hits, misses and time saved to the shared totals,
+        # and record when the rows it hit were used
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        hits, misses, saved = self._unflushed
+        used = self._used
+        self._unflushed = [0, 0, 0.0]
+        self._used = {}
+        if hits or misses:
+            self.db.execute("BEGIN IMMEDIATE")
+            for name, value in (("hits", hits), ("misses", misses), ("time_saved", saved)):
+                self.db.execute("INSERT INTO counters VALUES (?, ?) "
+                                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, value))
+            self.db.executemany("UPDATE results SET last_used = ? WHERE key = ? AND depth = ? AND variant = ?",
+                                [(last_used, key.to_bytes(_KEY_BYTES, "big"), depth, variant)
+                                 for (key, depth, variant), last_used in used.items()])
+            self.db.execute("COMMIT")
+
+    def stats(self):
+        # This process's counters
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'time_saved': self.time_saved,
+            'writes': self.writes,
+            'memory_entries': len(self.memory),
+        }
+
+    def totals(self):
+        # Counters of every process that has used the file, plus its size
+        with self.lock:
+            counters = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+            entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        hits = int(counters.get("hits", 0)) + self._unflushed[0]
+        misses = int(counters.get("misses", 0)) + self._unflushed[1]
+        lookups = hits + misses
+        return {
+            'entries': entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'time_saved': counters.get("time_saved", 0.0) + self._unflushed[2],
+        }
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM results")
+            self.db.execute("DELETE FROM counters")
+            self.memory.clear()
+            self._unflushed = [0, 0, 0.0]
+            self._used = {}
+
+    def close(self):
+        self.flush_stats()
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the shared search result cache")
+    parser.add_argument("command", choices=["stats", "clear"])
+    parser.add_argument("--path", default=CACHE_PATH)
+    args = parser.parse_args()
+    cache = ResultCache(args.path, warm_entries=0)
+    if args.command == "clear":
+        cache.clear()
+        print(f"cleared {args.path}")
+    else:
+        totals = cache.totals()
+        print(f"{args.path}: {totals['entries']} positions, {totals['hits']} hits / {totals['misses']} misses "
+              f"({totals['hit_ratio']:.1%}), {totals['time_saved']:.1f}s of search saved")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Blocking client for server.py, used by the pygame front end in remote mode.
+# A reader thread sorts incoming lines into replies (they echo the request
+# id) and states the server pushes on its own once the AI has moved.
+import json
+import queue
+import socket
+import threading
+
+
+class GameClient:
+    def __init__(self, host, port, timeout = 10.0):
+        self.timeout = timeout
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(None)
+        self.rfile = self.sock.makefile("rb")
+        self.wfile = self.sock.makefile("wb")
+        self.replies = queue.Queue()
+        self.pushed = queue.Queue()
+        self.next_id = 1
+        self.reader = threading.Thread(target=self._read, name="quarto-client", daemon=True)
+        self.reader.start()
+
+    @classmethod
+    def connect(cls, address):
+        # address is "host:port"
+        host, _, port = address.rpartition(":")
+        return cls(host or "127.0.0.1", int(port))
+
+    def request(self, op, **fields):
+        # Send one request and wait for its reply; errors raise ValueError
+        request_id = self.next_id
+        self.next_id += 1
+        self.wfile.write(json.dumps(dict(fields, op=op, id=request_id)).encode() + b"\n")
+        self.wfile.flush()
+        reply = self.replies.get(timeout=self.timeout)
+        if reply is None:
+            raise ConnectionError("server closed the connection")
+        if reply['op'] == 'error':
+            raise ValueError(reply['message'])
+        return reply
+
+    def poll(self):
+        # The latest state pushed by the server, or None
+        state = None
+        while True:
+            try:
+                state = self.pushed.get_nowait()
+            except queue.Empty:
+                return state
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _read(self):
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message.get('id') is not None:
+                    self.replies.put(message)
+                else:
+                    self.pushed.put(message)
+        except (OSError, ValueError):
+            pass
+        self.replies.put(None)
@@ -0,0 +1,269 @@
+# Headless Quarto rules shared by the AI and the pygame UI.
+# A piece is a 4-bit id (one bit per attribute) and the board is a few packed
+# integers, so checking a line is a couple of AND/compare operations.
+
+BOARD_SIZE = 4
+NUM_CELLS = BOARD_SIZE * BOARD_SIZE
+NUM_PIECES = 16
+FULL_BOARD = (1 << NUM_CELLS) - 1
+ALL_PIECES = (1 << NUM_PIECES) - 1
+# Undo stack entries per placement: cell, piece, won, threats, then the AND
+# and NOR of each of the (at most 3) lines through the cell
+_UNDO_STRIDE = 10
+
+# Piece attributes. The first attribute is the most significant bit of the id,
+# so range(NUM_PIECES) walks the pieces in the same order the UI always used.
+PASTRY_TYPES = ['Croissant', 'Eclair']
+FLAVORS = ['Strawberry', 'Matcha']
+COLLECTIONS = ['Traditional', 'Indulging']
+TOPPINGS = ['PowderSugar', 'WhippedCream']
+ATTRIBUTES = ['pastry_type', 'flavor', 'collection', 'topping']
+ATTRIBUTE_VALUES = [PASTRY_TYPES, FLAVORS, COLLECTIONS, TOPPINGS]
+ATTRIBUTE_BITS = [3, 2, 1, 0]
+
+
+def piece_id(pastry_type, flavor, collection, topping):
+    piece = 0
+    for values, value, bit in zip(ATTRIBUTE_VALUES, (pastry_type, flavor, collection, topping), ATTRIBUTE_BITS):
+        piece |= values.index(value) << bit
+    return piece
+
+
+def piece_attributes(piece):
+    return tuple(values[(piece >> bit) & 1] for values, bit in zip(ATTRIBUTE_VALUES, ATTRIBUTE_BITS))
+
+
+def piece_name(piece):
+    # Key into the pastry image table, e.g. "Croissant_Matcha_Traditional_PowderSugar"
+    return "_".join(piece_attributes(piece))
+
+
+class Piece(int):
+    # One of the 16 PIECES: the piece id itself, so the engine's bit tricks
+    # work on it unchanged, with the attributes the UI wants. There are no
+    # other instances, so passing pieces around never allocates.
+    __slots__ = ()
+
+    @property
+    def attributes(self):
+        return piece_attributes(self)
+
+    @property
+    def name(self):
+        return piece_name(self)
+
+    def __repr__(self):
+        return f"Piece({int(self)})"
+
+    def __reduce__(self):
+        # Unpickles to the shared instance
+        return _piece, (int(self),)
+
+
+PIECES = tuple(Piece(piece) for piece in range(NUM_PIECES))
+
+
+def _piece(piece):
+    return PIECES[piece]
+
+
+def cell_index(row, col):
+    return row * BOARD_SIZE + col
+
+
+def cell_position(cell):
+    return divmod(cell, BOARD_SIZE)
+
+
+# The 10 winning lines (rows, columns, diagonals) as cell tuples and bitmasks
+LINES = (
+    [tuple(cell_index(row, col) for col in range(BOARD_SIZE)) for row in range(BOARD_SIZE)] +
+    [tuple(cell_index(row, col) for row in range(BOARD_SIZE)) for col in range(BOARD_SIZE)] +
+    [tuple(cell_index(i, i) for i in range(BOARD_SIZE)),
+     tuple(cell_index(i, BOARD_SIZE - 1 - i) for i in range(BOARD_SIZE))]
+)
+LINE_MASKS = [sum(1 << cell for cell in line) for line in LINES]
+NUM_LINES = len(LINES)
+# The 2-3 lines passing through each cell
+CELL_LINES = [tuple(line for line in range(NUM_LINES) if cell in LINES[line]) for cell in range(NUM_CELLS)]
+
+# COMPLETING_PIECES[line_and << 4 | line_nor] is the mask of piece ids that win
+# a line holding three pieces with that running AND/NOR
+COMPLETING_PIECES = [
+    sum(1 << piece for piece in range(NUM_PIECES) if (piece & (i >> 4)) or ((15 ^ piece) & i & 15))
+    for i in range(256)
+]
+
+
+class Board:
+    def __init__(self):
+        # Bit i of occupied is set when cell i holds a piece, and bit i of
+        # bits[b] is set when that piece has bit b of its id set
+        self.occupied = 0
+        self.bits = [0, 0, 0, 0]
+        # Bit p is set once piece p is on the board
+        self.placed = 0
+        self.filled = 0
+        # Running state per line: filled cells, plus the AND and NOR of the
+        # piece ids in it. A full line wins when its AND or NOR is non-zero.
+        self.line_count = [0] * NUM_LINES
+        self.line_and = [15] * NUM_LINES
+        self.line_nor = [15] * NUM_LINES
+        self.won = False
+        # Threat index: the pieces that complete each line holding three
+        # pieces, and their union, so the pieces that win somewhere right now
+        # are a single mask
+        self.line_threats = [0] * NUM_LINES
+        self.threats = 0
+        # What undo() needs, _UNDO_STRIDE slots per placement, allocated once
+        # so placing and taking back pieces creates no objects
+        self.undo_stack = [0] * (NUM_CELLS * _UNDO_STRIDE)
+
+    def copy(self):
+        new_board = Board()
+        new_board.occupied = self.occupied
+        new_board.bits = self.bits[:]
+        new_board.placed = self.placed
+        new_board.filled = self.filled
+        new_board.line_count = self.line_count[:]
+        new_board.line_and = self.line_and[:]
+        new_board.line_nor = self.line_nor[:]
+        new_board.won = self.won
+        new_board.line_threats = self.line_threats[:]
+        new_board.threats = self.threats
+        new_board.undo_stack = self.undo_stack[:]
+        return new_board
+
+    def piece_at(self, row, col):
+        return self.piece_at_cell(cell_index(row, col))
+
+    def piece_at_cell(self, cell):
+        if not (self.occupied >> cell) & 1:
+            return None
+        piece = 0
+        for b in range(4):
+            piece |= ((self.bits[b] >> cell) & 1) << b
+        return PIECES[piece]
+
+    def empty_cells(self):
+        return [cell for cell in range(NUM_CELLS) if not (self.occupied >> cell) & 1]
+
+    def place_piece(self, piece, row, col):
+        return self.place(piece, cell_index(row, col))
+
+    def place(self, piece, cell):
+        bit = 1 << cell
+        if self.occupied & bit:
+            return False
+        self.occupied |= bit
+        for b in range(4):
+            if (piece >> b) & 1:
+                self.bits[b] |= bit
+        self.placed |= 1 << piece
+        undo = self.undo_stack
+        i = self.filled * _UNDO_STRIDE
+        self.filled += 1
+        undo[i] = cell
+        undo[i + 1] = piece
+        undo[i + 2] = self.won
+        undo[i + 3] = self.threats
+        i += 4
+
+        # Only the lines through this cell change
+        line_count = self.line_count
+        line_and = self.line_and
+        line_nor = self.line_nor
+        line_threats = self.line_threats
+        rebuild = False
+        for line in CELL_LINES[cell]:
+            undo[i] = line_and[line]
+            undo[i + 1] = line_nor[line]
+            i += 2
+            line_count[line] += 1
+            line_and[line] &= piece
+            line_nor[line] &= 15 ^ piece
+            if line_count[line] == 3:
+                line_threats[line] = COMPLETING_PIECES[(line_and[line] << 4) | line_nor[line]]
+                self.threats |= line_threats[line]
+            elif line_count[line] == 4:
+                if line_and[line] or line_nor[line]:
+                    self.won = True
+                if line_threats[line]:
+                    line_threats[line] = 0
+                    rebuild = True
+        if rebuild:
+            # A completed line no longer threatens; the others may share pieces
+            threats = 0
+            for pieces in line_threats:
+                threats |= pieces
+            self.threats = threats
+        return True
+
+    def undo(self):
+        # Take back the most recent placement
+        self.filled -= 1
+        undo = self.undo_stack
+        i = self.filled * _UNDO_STRIDE
+        cell, piece, self.won, self.threats = undo[i], undo[i + 1], undo[i + 2], undo[i + 3]
+        bit = 1 << cell
+        self.occupied &= ~bit
+        for b in range(4):
+            self.bits[b] &= ~bit
+        self.placed &= ~(1 << piece)
+        i += 4
+        for line in CELL_LINES[cell]:
+            count = self.line_count[line] - 1
+            self.line_count[line] = count
+            self.line_and[line] = undo[i]
+            self.line_nor[line] = undo[i + 1]
+            self.line_threats[line] = COMPLETING_PIECES[(undo[i] << 4) | undo[i + 1]] if count == 3 else 0
+            i += 2
+        return cell, PIECES[piece]
+
+    def is_full(self):
+        return self.filled == NUM_CELLS
+
+    def check_win(self):
+        return self.won
+
+    def winning_cell(self, piece):
+        # An empty cell where placing piece wins right away, or None
+        if not (self.threats >> piece) & 1:
+            return None
+        for line in range(NUM_LINES):
+            if (self.line_threats[line] >> piece) & 1:
+                return (LINE_MASKS[line] & ~self.occupied).bit_length() - 1
+        return None
+
+    def winning_pieces(self):
+        # Mask of piece ids that would win somewhere on this board
+        return self.threats
+
+    def safe_pieces(self, available_pieces):
+        # The pieces in available_pieces that can't win anywhere right away
+        threats = self.threats
+        return [piece for piece in available_pieces if not (threats >> piece) & 1]
+
+    def safe_gives(self):
+        # Mask of the pieces that can be handed over now, just after a
+        # placement, without the opponent winning right away; none once the
+        # placement has won
+        return 0 if self.won else ~(self.placed | self.threats) & ALL_PIECES
+
+    def safe_moves(self, piece):
+        # Every way to place piece and then hand over one of its safe_gives(),
+        # as cell << 4 | give, by cell then give. Every engine's moves come
+        # from here or from safe_gives(), so they all agree on what is safe.
+        moves = []
+        for cell in self.empty_cells():
+            self.place(piece, cell)
+            gives = self.safe_gives()
+            self.undo()
+            while gives:
+                low = gives & -gives
+                moves.append(cell << 4 | low.bit_length() - 1)
+                gives ^= low
+        return moves
+
+    def remaining_pieces(self):
+        return [piece for piece in PIECES if not (self.placed >> piece) & 1]
@@ -0,0 +1,132 @@
+# Static evaluation of Quarto positions for the search's leaves.
+# A line's value only depends on how many pieces it holds and which
+# attribute values they all share, so it is precomputed for every line state:
+# LINE_VALUES is indexed by the Board's running (count, AND, NOR) of a line,
+# and packed_values() by the line's four cells packed in base 17 (piece id,
+# or EMPTY), for boards held as NumPy arrays. evaluate_batch() scores
+# thousands of such boards in one call. NumPy is only imported by the batch
+# path, so the search doesn't load it.
+#
+#   python evaluate.py      times both evaluators
+import argparse
+import time
+
+from engine import LINES, NUM_CELLS, NUM_LINES, NUM_PIECES
+
+EMPTY = NUM_PIECES
+# Value per attribute value shared by every piece in a line of two or three
+# pieces, for the player about to place a piece. A line of three leaves
+# fewer safe pieces to give after placing, and running out of them loses; a
+# line of two is a threat the mover can complete. The weights were picked by
+# self-play at fixed depth (tournament.py) against a search without them.
+TWO_SHARED = 1
+THREE_SHARED = -4
+# Changes whenever the values do: cached search results (see cache.py) are
+# only reused under the same version
+EVALUATION_VERSION = 1
+
+
+def line_value(pieces):
+    # pieces are the ids in one line, empty cells left out
+    if len(pieces) < 2 or len(pieces) == 4:
+        # A full line that shares an attribute is a win and never evaluated
+        return 0
+    shared_ones = 15
+    shared_zeros = 15
+    for piece in pieces:
+        shared_ones &= piece
+        shared_zeros &= 15 ^ piece
+    shared = bin(shared_ones).count("1") + bin(shared_zeros).count("1")
+    return shared * (THREE_SHARED if len(pieces) == 3 else TWO_SHARED)
+
+
+def _count_value(count, line_and, line_nor):
+    if count < 2 or count == 4:
+        return 0
+    shared = bin(line_and).count("1") + bin(line_nor).count("1")
+    return shared * (THREE_SHARED if count == 3 else TWO_SHARED)
+
+
+# LINE_VALUES[count << 8 | AND << 4 | NOR]
+LINE_VALUES = [_count_value(i >> 8, (i >> 4) & 15, i & 15) for i in range(5 << 8)]
+
+_BASE = EMPTY + 1
+# (values, line cells, places) for evaluate_batch(), made on its first call
+_packed = None
+
+
+def packed_values():
+    # values[sum(cell_k * 17 ** k)] over a line's cells, EMPTY for none: the
+    # line_value() of every packed line, computed on whole arrays at once
+    global _packed
+    if _packed is None:
+        import numpy as np
+
+        places = np.array([_BASE ** k for k in range(4)], dtype=np.int64)
+        cells = np.arange(_BASE ** 4, dtype=np.int64)[:, None] // places % _BASE
+        present = cells != EMPTY
+        count = present.sum(axis=1)
+        shared_ones = np.bitwise_and.reduce(np.where(present, cells, 15), axis=1)
+        shared_zeros = np.bitwise_and.reduce(np.where(present, 15 ^ cells, 15), axis=1)
+        ones = np.array([bin(bits).count("1") for bits in range(16)])
+        shared = ones[shared_ones] + ones[shared_zeros]
+        values = np.select([count == 2, count == 3], [shared * TWO_SHARED, shared * THREE_SHARED], 0)
+        _packed = (values.astype(np.int32), np.array(LINES, dtype=np.intp), places)
+    return _packed
+
+
+def evaluate(board):
+    # Score for the player about to place a piece on board
+    score = 0
+    line_count = board.line_count
+    line_and = board.line_and
+    line_nor = board.line_nor
+    for line in range(NUM_LINES):
+        score += LINE_VALUES[(line_count[line] << 8) | (line_and[line] << 4) | line_nor[line]]
+    return score
+
+
+def board_array(board):
+    # The board's 16 cells as piece ids, EMPTY where there is none
+    import numpy as np
+
+    return np.array([EMPTY if piece is None else piece for piece in map(board.piece_at_cell, range(NUM_CELLS))],
+                    dtype=np.int64)
+
+
+def evaluate_batch(cells):
+    # cells is an (N, 16) integer array of boards as from board_array();
+    # returns the N evaluate() scores
+    import numpy as np
+
+    values, line_cells, places = packed_values()
+    packed = np.asarray(cells, dtype=np.int64)[:, line_cells] @ places
+    return values[packed].sum(axis=1)
+
+
+def main():
+    import numpy as np
+
+    from tournament import BENCHMARK_POSITIONS, benchmark_board
+
+    parser = argparse.ArgumentParser(description="Time the leaf evaluators")
+    parser.add_argument("--boards", type=int, default=100000)
+    args = parser.parse_args()
+
+    boards = [benchmark_board(placements) for _, placements, _ in BENCHMARK_POSITIONS]
+    count = args.boards
+    start = time.perf_counter()
+    for i in range(count):
+        evaluate(boards[i % len(boards)])
+    elapsed = time.perf_counter() - start
+    print(f"evaluate        {count / elapsed:12.0f} boards/s")
+    cells = np.array([board_array(boards[i % len(boards)]) for i in range(count)])
+    start = time.perf_counter()
+    scores = evaluate_batch(cells)
+    elapsed = time.perf_counter() - start
+    print(f"evaluate_batch  {count / elapsed:12.0f} boards/s")
+    assert all(scores[i] == evaluate(boards[i]) for i in range(len(boards)))
+
+
+if __name__ == "__main__":
+    main()
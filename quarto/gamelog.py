@@ -0,0 +1,262 @@
+# Compact binary log of played games, and a replayer that runs the logged
+# positions through an engine again.
+#
+# A log file starts with FILE_MAGIC and holds one record per game: a _GAME
+# header (time, engine id, which seats the AI played, ply count) and one byte
+# per ply, cell << 4 | piece, in the order the pieces were placed. The piece
+# placed at ply i is the one handed over before it, so the plies alone give
+# every position and every move of the game. GameLog appends records from a
+# background thread and rotates the file once it reaches max_bytes.
+#
+#   python gamelog.py stats
+#   python gamelog.py replay --engine minimax:depth=2 --out moves.bin
+#   python gamelog.py replay --engine minimax:depth=2 --baseline moves.bin
+import argparse
+import os
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import Board, NUM_PIECES, cell_index
+from tournament import close_engine, make_engine, percentile
+from worker import think
+
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.qgl")
+
+FILE_MAGIC = b"QGL1"
+# timestamp, engine id, seats, ply count
+_GAME = struct.Struct(">IBBB")
+# Seats: bit 0 when the AI placed the even plies (it was handed the first
+# piece), bit 1 when it placed the odd ones
+AI_FIRST = 1
+AI_SECOND = 2
+# Moves file written by replay --out: (cell, give) per position, NO_MOVE
+# for a give that isn't there because the placement ended the game
+NO_MOVE = 255
+
+
+def encode_game(plies, engine = 0, seats = 0, timestamp = None):
+    # plies are (cell, piece) in the order they were placed
+    if timestamp is None:
+        timestamp = time.time()
+    return _GAME.pack(int(timestamp), engine, seats, len(plies)) + bytes(cell << 4 | piece for cell, piece in plies)
+
+
+def read_games(path):
+    # Yields (timestamp, engine, seats, plies) with plies as the raw ply bytes.
+    # A record cut short by a crash ends the file.
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(FILE_MAGIC)] != FILE_MAGIC:
+        raise ValueError(f"{path} is not a game log")
+    offset = len(FILE_MAGIC)
+    while offset + _GAME.size <= len(data):
+        timestamp, engine, seats, count = _GAME.unpack_from(data, offset)
+        offset += _GAME.size
+        if offset + count > len(data):
+            break
+        yield timestamp, engine, seats, data[offset:offset + count]
+        offset += count
+
+
+def log_files(path = LOG_PATH):
+    # The current file and its rotated predecessors, oldest first
+    files = []
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        files.insert(0, f"{path}.{index}")
+        index += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def decode_ply(ply):
+    # (cell, piece)
+    return ply >> 4, ply & 15
+
+
+class GameLog:
+    def __init__(self, path = LOG_PATH, max_bytes = 4 << 20, backups = 5):
+        # Past max_bytes the file becomes path.1, the previous path.1 becomes
+        # path.2 and so on, keeping backups old files
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        # Records are written by a thread so the frame loop never waits on disk
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="quarto-gamelog", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def open_default(cls):
+        return cls(LOG_PATH)
+
+    def write(self, plies, engine = 0, seats = 0):
+        self.queue.put(encode_game(plies, engine, seats))
+
+    def close(self):
+        # Writes what is queued, then stops the thread
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        f = None
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            if f is None:
+                f = self._open()
+            if f.tell() + len(record) > self.max_bytes and f.tell() > len(FILE_MAGIC):
+                f.close()
+                self._rotate()
+                f = self._open()
+            f.write(record)
+            f.flush()
+        if f is not None:
+            f.close()
+
+    def _open(self):
+        f = open(self.path, "ab")
+        if f.tell() == 0:
+            f.write(FILE_MAGIC)
+        return f
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+def game_result(plies):
+    # Index of the ply that won the game, -1 for a draw, None if unfinished
+    board = Board()
+    for index, ply in enumerate(plies):
+        cell, piece = decode_ply(ply)
+        board.place(piece, cell)
+        if board.check_win():
+            return index
+    return -1 if board.is_full() else None
+
+
+def _replay_game(spec, seed, plies, ai_seats):
+    # Runs in a pool worker: the engine's move at every position of one game
+    # (or only those the AI played when ai_seats is given), as
+    # (ply, cell, give, seconds)
+    engine = make_engine(spec, seed)
+    board = Board()
+    available = list(range(NUM_PIECES))
+    moves = []
+    try:
+        for index, ply in enumerate(plies):
+            cell, piece = decode_ply(ply)
+            available.remove(piece)
+            if not ai_seats or ai_seats & (AI_SECOND if index % 2 else AI_FIRST):
+                start = time.perf_counter()
+                row, col, give = think(engine, board.copy(), piece, list(available))
+                moves.append((index, cell_index(row, col), give, time.perf_counter() - start))
+            board.place(piece, cell)
+    finally:
+        close_engine(engine)
+    return moves
+
+
+def replay(files, spec, workers, limit, ai_only, chunksize, out = None, baseline = None):
+    # All positions of a game go through one engine, in order, so the
+    # answers don't depend on how games are spread over the workers
+    games = []
+    for path in files:
+        for _, _, seats, plies in read_games(path):
+            if ai_only and not seats:
+                continue
+            games.append((seats, plies))
+            if limit is not None and len(games) >= limit:
+                break
+        if limit is not None and len(games) >= limit:
+            break
+    seeds = range(len(games))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(_replay_game, [spec] * len(games), seeds, [plies for _, plies in games],
+                                [seats if ai_only else 0 for seats, _ in games], chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+
+    positions = 0
+    same_as_log = 0
+    times = []
+    answers = bytearray()
+    for (_, plies), moves in zip(games, results):
+        for index, cell, give, seconds in moves:
+            positions += 1
+            times.append(seconds)
+            logged_give = plies[index + 1] & 15 if index + 1 < len(plies) else None
+            if cell == plies[index] >> 4 and (give == logged_give or logged_give is None):
+                same_as_log += 1
+            answers += bytes((cell, NO_MOVE if give is None else give))
+    print(f"{spec}: {positions} positions from {len(games)} games in {elapsed:.1f}s "
+          f"({positions / elapsed if elapsed > 0 else 0:.0f} positions/s)")
+    if times:
+        print(f"  move time p50 {percentile(times, 50) * 1000:.1f}  p95 {percentile(times, 95) * 1000:.1f}  "
+              f"p99 {percentile(times, 99) * 1000:.1f} ms")
+        print(f"  same move as logged {same_as_log}/{positions} ({same_as_log / positions:.1%})")
+    if out is not None:
+        with open(out, "wb") as f:
+            f.write(answers)
+    changed = None
+    if baseline is not None:
+        with open(baseline, "rb") as f:
+            expected = f.read()
+        if len(expected) != len(answers):
+            raise ValueError(f"{baseline} has {len(expected) // 2} positions, this replay has {positions}")
+        changed = [i // 2 for i in range(0, len(answers), 2) if answers[i:i + 2] != expected[i:i + 2]]
+        print(f"  changed from {baseline}: {len(changed)}/{positions}")
+        for position in changed[:10]:
+            print(f"    position {position}: {tuple(expected[position * 2:position * 2 + 2])} -> "
+                  f"{tuple(answers[position * 2:position * 2 + 2])}")
+    return {'positions': positions, 'time': elapsed, 'same_as_log': same_as_log, 'changed': changed}
+
+
+def stats(files):
+    games = plies = wins = draws = 0
+    for path in files:
+        for _, _, _, game in read_games(path):
+            games += 1
+            plies += len(game)
+            result = game_result(game)
+            if result == -1:
+                draws += 1
+            elif result is not None:
+                wins += 1
+    print(f"{len(files)} files, {games} games, {plies} positions: {wins} won, {draws} drawn, "
+          f"{games - wins - draws} unfinished")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay game logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_parser = commands.add_parser("stats", help="count games and results")
+    stats_parser.add_argument("files", nargs="*", help="log files (default: games.qgl and its rotations)")
+    replay_parser = commands.add_parser("replay", help="run logged positions through an engine")
+    replay_parser.add_argument("files", nargs="*", help="log files (default: games.qgl and its rotations)")
+    replay_parser.add_argument("--engine", default="minimax:depth=2", help="engine spec, as in tournament.py")
+    replay_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    replay_parser.add_argument("--limit", type=int, help="replay at most this many games")
+    replay_parser.add_argument("--ai-only", action="store_true", help="only the positions the AI played")
+    replay_parser.add_argument("--chunksize", type=int, default=16, help="games sent to a worker at a time")
+    replay_parser.add_argument("--out", help="write the engine's moves here")
+    replay_parser.add_argument("--baseline", help="moves written by an earlier --out to compare against")
+    args = parser.parse_args()
+
+    files = args.files or log_files()
+    if args.command == "stats":
+        stats(files)
+    else:
+        replay(files, args.engine, args.workers, args.limit, args.ai_only, args.chunksize, args.out, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
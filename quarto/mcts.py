@@ -0,0 +1,279 @@
+# Monte Carlo tree search player, a second engine next to QuartoAI.
+# The tree is ordinary UCT over (place, give) moves on one Board that is
+# walked with place/undo. Leaves are scored by random playouts run in NumPy:
+# a batch of leaves is selected at once (pending visits count as draws so the
+# batch spreads out), and all their playouts advance together as integer
+# arrays, one placement per step.
+#
+#   python mcts.py --time 1.0
+#
+# prints playouts per second on a fixed position.
+import argparse
+import math
+import random
+import time
+
+import numpy as np
+
+from Agent import SearchCancelled
+from engine import Board, LINES, NUM_CELLS, NUM_PIECES, cell_position
+
+_LINE_CELLS = np.array(LINES, dtype=np.intp)
+
+
+class _Node:
+    def __init__(self, parent, move, piece):
+        self.parent = parent
+        # (cell, give) that led here; cell is None below a give-only root
+        self.move = move
+        # Piece the player to move has to place, None at a give-only root
+        self.piece = piece
+        self.children = []
+        self.untried = None
+        # Value for the player to move when the game is decided here
+        self.terminal = None
+        self.visits = 0
+        # Sum of results for the player who made self.move
+        self.value = 0.0
+
+
+def _expand(node, board, rng):
+    # Fill in node.untried, or node.terminal when the position is decided
+    piece = node.piece
+    if piece is None:
+        remaining = board.remaining_pieces()
+        gives = board.safe_pieces(remaining) or remaining
+        node.untried = [(None, give) for give in gives]
+    elif board.winning_cell(piece) is not None:
+        node.terminal = 1
+        return
+    elif board.filled == NUM_CELLS - 1:
+        # The last piece goes in the last cell without winning
+        node.terminal = 0
+        return
+    else:
+        moves = [(move >> 4, move & 15) for move in board.safe_moves(piece)]
+        if not moves:
+            # Every placement hands over a winning piece
+            node.terminal = -1
+            return
+        node.untried = moves
+    rng.shuffle(node.untried)
+
+
+def playouts(cells, hand, remaining, rng):
+    # Play random games to the end, all in lockstep. cells is (games, 16) with
+    # the piece id in each cell or -1, hand the piece each game's player to
+    # move holds and remaining the pieces not yet used. The arrays are
+    # modified. Returns +1/0/-1 per game for the player to move at the start.
+    games = len(hand)
+    result = np.zeros(games, dtype=np.int8)
+    sign = np.ones(games, dtype=np.int8)
+    active = np.arange(games)
+    while len(active):
+        # Place the piece in hand on a random empty cell
+        keys = rng.random((len(active), NUM_CELLS))
+        keys[cells[active] >= 0] = -1.0
+        cell = keys.argmax(axis=1)
+        cells[active, cell] = hand[active]
+
+        lines = cells[active][:, _LINE_CELLS]
+        full = (lines >= 0).all(axis=2)
+        line_and = np.bitwise_and.reduce(lines, axis=2) & 15
+        line_nor = np.bitwise_and.reduce(~lines, axis=2) & 15
+        won = (full & ((line_and | line_nor) != 0)).any(axis=1)
+        result[active[won]] = sign[active[won]]
+        drawn = ~won & (cells[active] >= 0).all(axis=1)
+        active = active[~won & ~drawn]
+        if not len(active):
+            break
+
+        # Hand the opponent a random remaining piece
+        keys = rng.random((len(active), NUM_PIECES))
+        keys[~remaining[active]] = -1.0
+        give = keys.argmax(axis=1)
+        remaining[active, give] = False
+        hand[active] = give
+        sign[active] = -sign[active]
+    return result
+
+
+class MCTSPlayer:
+    def __init__(self, iterations = None, time_budget = 1.0, leaf_batch = 16, playouts_per_leaf = 64,
+                 exploration = 1.4, seed = None):
+        # Stops after iterations leaf evaluations or time_budget seconds,
+        # whichever comes first; each evaluation is playouts_per_leaf playouts
+        if iterations is None and time_budget is None:
+            raise ValueError("MCTSPlayer needs an iteration count or a time budget")
+        self.iterations = iterations
+        self.time_budget = time_budget
+        self.leaf_batch = leaf_batch
+        self.playouts_per_leaf = playouts_per_leaf
+        self.exploration = exploration
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        # Set from another thread to abandon the running search
+        self.stopped = False
+        # Iterations, playouts, playouts per second and time of the last search
+        self.last_stats = None
+        # (occupied, placed, give) planned by the last get_best_move
+        self.planned = None
+
+    def choose_piece(self, available_pieces, board = None):
+        if self.planned is not None and board is not None:
+            occupied, placed, give = self.planned
+            if board.occupied == occupied and board.placed == placed and give in available_pieces:
+                return give
+        if board is None or board.filled == 0:
+            # Every piece is equivalent on an empty board
+            return self.rng.choice(available_pieces)
+        return self.search(board, None)[1][1]
+
+    def get_best_move(self, board, piece):
+        score, (cell, give) = self.search(board, piece)
+        self.planned = (board.occupied | (1 << cell), board.placed | (1 << piece), give)
+        return cell_position(cell)
+
+    def stop(self):
+        # Ask a search running on another thread to give up; it raises
+        # SearchCancelled
+        self.stopped = True
+
+    def search(self, board, piece):
+        # Returns (win rate, (cell, give)) for the player about to place
+        # piece, or about to give a piece when piece is None. board is
+        # restored before returning.
+        self.stopped = False
+        start = time.perf_counter()
+        root = _Node(None, None, piece)
+        _expand(root, board, self.rng)
+        if root.terminal is not None:
+            return self._decided_move(board, piece, root.terminal)
+
+        iterations = 0
+        total_playouts = 0
+        deadline = None if self.time_budget is None else start + self.time_budget
+        while True:
+            if self.stopped:
+                raise SearchCancelled
+            if self.iterations is not None and iterations >= self.iterations:
+                break
+            if deadline is not None and iterations and time.perf_counter() >= deadline:
+                break
+            iterations += self.leaf_batch
+            total_playouts += self._run_batch(root, board)
+
+        best = max(root.children, key=lambda child: child.visits)
+        elapsed = time.perf_counter() - start
+        self.last_stats = {
+            'iterations': iterations,
+            'playouts': total_playouts,
+            'playouts_per_sec': total_playouts / elapsed if elapsed > 0 else 0.0,
+            'time': elapsed,
+            'score': best.value / best.visits,
+        }
+        return best.value / best.visits, best.move
+
+    def _decided_move(self, board, piece, value):
+        # The root is won, drawn or lost whatever happens; any legal move
+        cell = board.winning_cell(piece)
+        if cell is not None:
+            return value, (cell, None)
+        cell = board.empty_cells()[0]
+        board.place(piece, cell)
+        give = None if board.filled == NUM_CELLS else board.remaining_pieces()[0]
+        board.undo()
+        return value, (cell, give)
+
+    def _run_batch(self, root, board):
+        # Select up to leaf_batch leaves, score them with one batch of
+        # playouts and back the results up. Returns the number of playouts.
+        leaves = []
+        states = []
+        for _ in range(self.leaf_batch):
+            node = self._select(root, board)
+            if node.terminal is not None:
+                self._backup(node, node.terminal)
+            else:
+                leaves.append(node)
+                states.append(self._state(board, node.piece))
+            self._unwind(board, node)
+        if not leaves:
+            return 0
+
+        count = self.playouts_per_leaf
+        cells = np.repeat(np.array([s[0] for s in states], dtype=np.int8), count, axis=0)
+        hand = np.repeat(np.array([s[1] for s in states], dtype=np.int8), count)
+        remaining = np.repeat(np.array([s[2] for s in states], dtype=bool), count, axis=0)
+        results = playouts(cells, hand, remaining, self.np_rng)
+        values = results.reshape(len(leaves), count).mean(axis=1)
+        for node, value in zip(leaves, values):
+            self._backup(node, float(value))
+        return len(leaves) * count
+
+    def _select(self, node, board):
+        # Walk down by UCT, playing the moves on board, and add one new child.
+        # Visits are counted on the way down so the rest of the batch sees
+        # them (as draws until the result comes back).
+        while True:
+            node.visits += 1
+            if node.terminal is not None:
+                return node
+            if node.untried:
+                move = node.untried.pop()
+                child = _Node(node, move, move[1])
+                node.children.append(child)
+                self._play(board, node.piece, move)
+                child.visits += 1
+                _expand(child, board, self.rng)
+                return child
+            log_visits = math.log(node.visits)
+            exploration = self.exploration
+            node = max(node.children, key=lambda child:
+                       child.value / child.visits + exploration * math.sqrt(log_visits / child.visits))
+            self._play(board, node.parent.piece, node.move)
+
+    def _play(self, board, piece, move):
+        if move[0] is not None:
+            board.place(piece, move[0])
+
+    def _unwind(self, board, node):
+        # Take back the placements made on the way down to node
+        while node.parent is not None:
+            if node.move[0] is not None:
+                board.undo()
+            node = node.parent
+
+    def _backup(self, node, value):
+        # value is for the player to move at node; each move up switches player
+        while node is not None:
+            value = -value
+            node.value += value
+            node = node.parent
+
+    def _state(self, board, piece):
+        cells = [board.piece_at_cell(cell) for cell in range(NUM_CELLS)]
+        cells = [-1 if p is None else p for p in cells]
+        remaining = [not (board.placed >> p) & 1 and p != piece for p in range(NUM_PIECES)]
+        return cells, piece, remaining
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Playouts per second of the MCTS player")
+    parser.add_argument('--time', type=float, default=1.0, help="seconds of search")
+    parser.add_argument('--leaf-batch', type=int, default=16)
+    parser.add_argument('--playouts', type=int, default=64, help="playouts per leaf")
+    args = parser.parse_args()
+
+    board = Board()
+    for piece, cell in [(0, 0), (5, 6), (10, 9), (15, 12), (3, 1)]:
+        board.place(piece, cell)
+    player = MCTSPlayer(time_budget=args.time, leaf_batch=args.leaf_batch, playouts_per_leaf=args.playouts, seed=0)
+    score, (cell, give) = player.search(board, 6)
+    stats = player.last_stats
+    print(f"{stats['iterations']} leaves, {stats['playouts']} playouts in {stats['time']:.2f}s "
+          f"({stats['playouts_per_sec']:.0f}/s), move {cell_position(cell)} give {give}, win rate {score:+.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# Parallel root search for QuartoAI.
+# The root (place, give) moves are split across a process pool. Workers share
+# the best root result found so far as an alpha bound. A move ordered before
+# the current best is searched with a window one point lower, so it can still
+# win a tie, exactly as it would in serial move order: at a fixed depth
+# ParallelQuartoAI picks the same move as QuartoAI. The pool is started,
+# and every worker set up, when the AI is made, so no search pays for it.
+# In engine specs it is minimax with workers=<processes> (see tournament.py).
+#
+#   python parallel.py --depth 3 --workers 1 2 4 8
+#
+# prints the speedup curve on a fixed position.
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from Agent import QuartoAI, SearchTimeout, INFINITY
+from engine import Board, NUM_CELLS, cell_position
+from tablebase import Tablebase
+from symmetry import canonical_transform, from_canonical_cell, from_canonical_piece, to_canonical_cell, to_canonical_piece
+from transposition import EXACT
+
+# The shared best is packed as score * _INDEX_RANGE + (_INDEX_RANGE - 1 - index)
+# so that comparing packed values compares (score, earlier move)
+_INDEX_RANGE = 256
+_NO_BEST = -INFINITY * _INDEX_RANGE
+
+# State of each pool worker process, set up by _init_worker
+_worker_ai = None
+_best_score = None
+_abort = None
+
+
+class _WorkerAI(QuartoAI):
+    def _should_stop(self):
+        return _abort.value or super()._should_stop()
+
+
+def _init_worker(best_score, abort, ready, table_size, endgame_empties, tablebase_path):
+    global _worker_ai, _best_score, _abort
+    # Each worker maps the same tablebase file, so they share its pages
+    tablebase = Tablebase(tablebase_path) if tablebase_path else None
+    _worker_ai = _WorkerAI(table_size=table_size, endgame_empties=endgame_empties, tablebase=tablebase)
+    _best_score = best_score
+    _abort = abort
+    with ready.get_lock():
+        ready.value += 1
+
+
+def _search_moves(board, piece, depth, indexed_moves, deadline):
+    # Search a chunk of root moves. Returns ([(index, score, exact)] for the
+    # moves that finished, whether the search was interrupted, nodes).
+    # deadline is the caller's: perf_counter is one clock for every process
+    # on the machine, so a chunk that waited in the queue gets no extra time.
+    ai = _worker_ai
+    ai._new_search()
+    ai.deadline = deadline
+    filled = board.filled
+    results = []
+    try:
+        for index, (cell, give) in indexed_moves:
+            best = _best_score.value
+            if best == _NO_BEST:
+                alpha = -INFINITY
+            else:
+                best_score, rest = divmod(best, _INDEX_RANGE)
+                best_index = _INDEX_RANGE - 1 - rest
+                # A move ordered earlier than the best wins ties, so it has
+                # to come back exact when it only equals the best score
+                alpha = best_score - 1 if index < best_index else best_score
+            board.place(piece, cell)
+            score = -ai._negamax(board, give, depth - 1, -INFINITY, -alpha, 1)
+            board.undo()
+            exact = score > alpha
+            if exact:
+                packed = score * _INDEX_RANGE + (_INDEX_RANGE - 1 - index)
+                with _best_score.get_lock():
+                    if packed > _best_score.value:
+                        _best_score.value = packed
+            results.append((index, score, exact))
+    except SearchTimeout:
+        ai._unwind(board, filled)
+        return results, True, ai.nodes
+    finally:
+        ai.deadline = None
+    return results, False, ai.nodes
+
+
+class ParallelQuartoAI(QuartoAI):
+    def __init__(self, max_depth = 3, table_size = 1 << 18, time_budget = None, endgame_empties = None,
+                 tablebase = None, book = None, cache = None, trace = None, profile = None, workers = None):
+        super().__init__(max_depth, table_size, time_budget, endgame_empties, tablebase,
+                         book=book, cache=cache, trace=trace, profile=profile)
+        self.workers = workers or os.cpu_count() or 1
+        self.table_size = table_size
+        self.tablebase_path = tablebase.path if tablebase is not None else None
+        self.best_score = multiprocessing.Value('q', _NO_BEST)
+        self.abort = multiprocessing.Value('b', 0)
+        # Counts the workers that have finished _init_worker
+        ready = multiprocessing.Value('i', 0)
+        self.executor = ProcessPoolExecutor(
+            self.workers, initializer=_init_worker,
+            initargs=(self.best_score, self.abort, ready, self.table_size, self.endgame_empties, self.tablebase_path))
+        # Workers start with the first tasks; wait until all of them are up so
+        # the first timed search doesn't spend its budget starting processes
+        for _ in range(self.workers):
+            self.executor.submit(int)
+        while ready.value < self.workers:
+            time.sleep(0.001)
+
+    def search(self, board, piece, depth = None):
+        def run(depth):
+            self.root_move = None
+            return self._search_root(board, piece, depth)
+        return self._run_search(board, piece, run, depth)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def _search_root(self, board, piece, depth):
+        # Positions decided at the root, or too shallow to be worth splitting,
+        # are searched in this process
+        if depth <= 1 or board.winning_cell(piece) is not None or board.filled >= NUM_CELLS - 1 or self._solved(board):
+            return self._negamax(board, piece, depth, -INFINITY, INFINITY, 0), self.root_move
+        key, sym = canonical_transform(board, piece)
+        entry = self.table.probe(key)
+        hint = None
+        if entry is not None and entry[4] is not None:
+            hint = from_canonical_cell(sym, entry[4][0]) << 4 | from_canonical_piece(sym, entry[4][1])
+        # Root moves go to the workers as (cell, give)
+        moves = [(move >> 4, move & 15) for move in self._order_moves(board, piece, 0, hint)]
+        if not moves:
+            return self._negamax(board, piece, depth, -INFINITY, INFINITY, 0), self.root_move
+
+        pool = self.executor
+        self.best_score.value = _NO_BEST
+        self.abort.value = 0
+        # Small chunks in move order: the likely best moves finish first and
+        # raise the shared bound for everything after them
+        chunk = max(1, len(moves) // (self.workers * 4))
+        pending = set()
+        for start in range(0, len(moves), chunk):
+            indexed = [(i, moves[i]) for i in range(start, min(start + chunk, len(moves)))]
+            pending.add(pool.submit(_search_moves, board, piece, depth, indexed, self.deadline))
+
+        results = []
+        interrupted = False
+        while pending:
+            # Wake up at the deadline rather than on the next poll after it
+            timeout = 0.05
+            if self.deadline is not None and not self.abort.value:
+                timeout = min(timeout, max(0.0, self.deadline - time.perf_counter()))
+            done, pending = wait(pending, timeout=timeout)
+            for future in done:
+                if future.cancelled():
+                    continue
+                finished, chunk_interrupted, nodes = future.result()
+                results.extend(finished)
+                interrupted = interrupted or chunk_interrupted
+                self.nodes += nodes
+            if pending and not self.abort.value and self._should_stop():
+                # Workers notice the flag within a few hundred nodes
+                self.abort.value = 1
+                for future in pending:
+                    future.cancel()
+                interrupted = True
+
+        exact = [(score, -index) for index, score, is_exact in results if is_exact]
+        if interrupted:
+            # Only trust a partial result that includes the previous best move
+            if exact and any(index == 0 for index, _, _ in results):
+                score, neg_index = max(exact)
+                self.root_move = moves[-neg_index]
+                self.root_score = score
+            raise SearchTimeout
+        score, neg_index = max(exact)
+        best_move = moves[-neg_index]
+        self.root_move = best_move
+        self.root_score = score
+        canonical_move = (to_canonical_cell(sym, best_move[0]), to_canonical_piece(sym, best_move[1]))
+        self.table.store(key, depth, EXACT, score, canonical_move)
+        return score, best_move
+
+
+def _benchmark_position():
+    # Five pieces down with no immediate threats: wide enough to need a pool
+    board = Board()
+    for piece, cell in [(0, 0), (5, 6), (10, 9), (15, 12), (3, 1)]:
+        board.place(piece, cell)
+    return board, 6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speedup of the parallel root search over the serial search")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    board, piece = _benchmark_position()
+    ai = QuartoAI(args.depth)
+    start = time.perf_counter()
+    serial_score, serial_move = ai.search(board, piece)
+    serial_time = time.perf_counter() - start
+    print(f"serial     {serial_time:8.3f}s  nodes {ai.nodes:9d}  move {cell_position(serial_move[0])} give {serial_move[1]}")
+
+    for workers in args.workers:
+        parallel_ai = ParallelQuartoAI(args.depth, workers=workers)
+        start = time.perf_counter()
+        score, move = parallel_ai.search(board, piece)
+        elapsed = time.perf_counter() - start
+        parallel_ai.close()
+        same = "same" if (score, move) == (serial_score, serial_move) else "DIFFERENT"
+        print(f"workers {workers:2d} {elapsed:8.3f}s  nodes {parallel_ai.nodes:9d}  speedup {serial_time / elapsed:5.2f}x  {same}")
+
+
+if __name__ == "__main__":
+    main()
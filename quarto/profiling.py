@@ -0,0 +1,111 @@
+# Profiles one QuartoAI search at a time, for QuartoAI(profile=...).
+# "cprofile" traces every call of the searching thread; "sample" only looks
+# at its stack every millisecond or so, which barely slows the search down
+# and so shows where time goes at full speed.
+#
+#   python profiling.py --mode sample --position middle --depth 5
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MODES = ["cprofile", "sample"]
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id = None, interval = 0.001):
+        # Samples the given thread, the calling one by default
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = 0
+        # Samples with the function on top of the stack, and anywhere on it
+        self.own = Counter()
+        self.total = Counter()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="quarto-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples += 1
+                self.own[_location(frame)] += 1
+                seen = set()
+                while frame is not None:
+                    seen.add(_location(frame))
+                    frame = frame.f_back
+                self.total.update(seen)
+
+    def report(self, limit = 25):
+        lines = [f"{self.samples} samples", f"{'own':>7s} {'total':>7s}  function"]
+        for location, count in self.own.most_common(limit):
+            lines.append(f"{count / self.samples:7.1%} {self.total[location] / self.samples:7.1%}  {location}")
+        return "\n".join(lines)
+
+
+def _location(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}({code.co_name})"
+
+
+def profile_call(mode, fn, *args):
+    # Returns fn(*args) and a text report of where the time went
+    if mode == "cprofile":
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            result = fn(*args)
+        finally:
+            profile.disable()
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(25)
+        return result, out.getvalue()
+    if mode == "sample":
+        sampler = SamplingProfiler()
+        sampler.start()
+        try:
+            result = fn(*args)
+        finally:
+            sampler.stop()
+        return result, sampler.report()
+    raise ValueError(f"unknown profile mode {mode!r}, expected one of {PROFILE_MODES}")
+
+
+def main():
+    from Agent import QuartoAI
+    from tournament import BENCHMARK_POSITIONS, benchmark_board
+
+    names = [name for name, _, _ in BENCHMARK_POSITIONS]
+    parser = argparse.ArgumentParser(description="Profile one QuartoAI search on a benchmark position")
+    parser.add_argument("--mode", choices=PROFILE_MODES, default="sample")
+    parser.add_argument("--position", choices=names, default="middle")
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args()
+
+    _, placements, piece = BENCHMARK_POSITIONS[names.index(args.position)]
+    ai = QuartoAI(max_depth=args.depth, profile=args.mode)
+    score, move = ai.search(benchmark_board(placements), piece)
+    print(ai.last_profile)
+    stats = ai.last_stats
+    print(f"move {move} score {score}: {stats['nodes']} nodes in {stats['time']:.3f}s, "
+          f"{stats['evaluations']} evaluations, {stats['cutoffs']} cutoffs, "
+          f"table hit rate {stats['table_hit_rate']:.1%}, branching {stats['branching']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Retained-mode drawing for the pygame UI.
+# Sprites are scaled once per size and converted to the display's pixel
+# format, so a frame is only plain blits. The screen is described as named
+# regions, each with a key for what it shows; a region is redrawn and pushed
+# to the display only when its key changes (or it overlaps one that did).
+import pygame
+
+from Quarto import image, pastry_image
+
+
+def _convert(surface):
+    # Match the display format so blits don't convert every frame
+    if surface.get_flags() & pygame.SRCALPHA:
+        return surface.convert_alpha()
+    return surface.convert()
+
+
+class SpriteCache:
+    def __init__(self):
+        self.sprites = {}
+
+    def pastry(self, piece, size):
+        key = ("pastry", piece, size)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = _convert(pastry_image(piece, (size, size)))
+            self.sprites[key] = sprite
+        return sprite
+
+    def image(self, name, size):
+        key = (name, size)
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = _convert(image(name, size))
+            self.sprites[key] = sprite
+        return sprite
+
+    def clear(self):
+        self.sprites.clear()
+
+
+class Renderer:
+    def __init__(self, screen):
+        self.screen = screen
+        # A new scene (start screen, game, game over) redraws everything
+        self.scene = None
+        self.full = True
+        self.background = None
+        # name -> (rect, key) as last drawn
+        self.regions = {}
+        self.queue = []
+        # Rects sent to the display by the last present()
+        self.updated = []
+
+    def begin(self, scene, background):
+        # Start a frame. Returns True when the whole screen is being redrawn,
+        # in which case the caller draws anything that isn't a region.
+        self.full = scene != self.scene
+        self.scene = scene
+        self.queue = []
+        if self.full:
+            self.background = background
+            self.regions.clear()
+            self.screen.blit(background, (0, 0))
+        return self.full
+
+    def snapshot(self):
+        # Restore regions from what is on the screen now rather than the
+        # background, for the rest of this scene: for regions drawn over
+        # more than the background, like a button over the dimmed game
+        self.background = self.screen.copy()
+
+    def invalidate(self):
+        # Redraw everything next frame
+        self.scene = None
+
+    def region(self, name, rect, key, draw):
+        # draw() paints rect; it is called again only when key changes
+        rect = pygame.Rect(rect)
+        if self.full:
+            self.regions[name] = (rect, key)
+            self._draw(rect, draw)
+        else:
+            self.queue.append((name, rect, key, draw))
+
+    def present(self):
+        # Draw the changed regions and push them to the display
+        if self.full:
+            pygame.display.flip()
+            self.full = False
+            self.updated = [self.screen.get_rect()]
+            return self.updated
+
+        # The area of a changed region covers where it was and where it is now
+        areas = []
+        changed = []
+        for name, rect, key, _ in self.queue:
+            previous = self.regions.get(name)
+            if previous is None:
+                areas.append(rect)
+                changed.append(True)
+            else:
+                areas.append(rect.union(previous[0]))
+                changed.append(previous[1] != key)
+        # Restoring the background under a region wipes whatever overlaps it,
+        # so overlapping regions are redrawn too
+        spreading = any(changed)
+        while spreading:
+            spreading = False
+            for i, area in enumerate(areas):
+                if changed[i]:
+                    continue
+                if any(changed[j] and area.colliderect(areas[j]) for j in range(len(areas))):
+                    changed[i] = True
+                    spreading = True
+
+        dirty = [areas[i] for i in range(len(areas)) if changed[i]]
+        for area in dirty:
+            self.screen.blit(self.background, area, area)
+        for i, (name, rect, key, draw) in enumerate(self.queue):
+            if changed[i]:
+                self.regions[name] = (rect, key)
+                self._draw(areas[i], draw)
+        if dirty:
+            pygame.display.update(dirty)
+        self.queue = []
+        self.updated = dirty
+        return dirty
+
+    def _draw(self, area, draw):
+        self.screen.set_clip(area)
+        draw()
+        self.screen.set_clip(None)
@@ -1,243 +1,90 @@
+import argparse
 import pygame
 import sys
-import pygame.freetype
-
-
-import random
-import copy
-
-# Initialize Pygame
-pygame.init()
-
-
-
-# Constants
-WINDOW_SIZE = (1200, 800)
-BOARD_SIZE = 4
-CELL_SIZE = 140  
-PIECE_SIZE = 120  
-MARGIN = 50
-PIECE_SELECTION_SIZE = 80  
-
-# Colors
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-LIGHT_PINK = (255, 230, 230)
-DARK_PINK = (255, 200, 200)
-LIGHT_BROWN = (210, 180, 140)
-LIGHT_BUTTER = (249,229,187)
-BLACK_BEAN = (73,27,21)
-SUMMER_BERRY = (229,154,202)
-TUSCAN_RED = (137, 29, 26)
-CREAMY_BISCOTTI = (241, 230, 210)
-OLIVEWOOD = (33, 7, 6)
-
-# Create the game window
-screen = pygame.display.set_mode(WINDOW_SIZE)
-pygame.display.set_caption("La Gourmandine Quarto")
-
-# Load fonts
-pygame.freetype.init()
-title_font = pygame.freetype.Font("font/RozhaOne-Regular.ttf", 48)
-prompt_font = pygame.freetype.Font("font/RozhaOne-Regular.ttf", 24)
-button_font = pygame.freetype.Font("font/RozhaOne-Regular.ttf", 32)
-
-# Load images
-background_img = pygame.image.load('bg/2.png')
-background_img = pygame.transform.scale(background_img, WINDOW_SIZE)
-prompt_img = pygame.image.load('bg/1.png')
-prompt_img = pygame.transform.scale(prompt_img, WINDOW_SIZE)
-
-# Load pastry images
-pastry_images = {}
-for pt in ['Croissant', 'Eclair']:
-    for f in ['Strawberry', 'Matcha']:
-        for c in ['Traditional', 'Indulging']:
-            for t in ['PowderSugar', 'WhippedCream']:
-                key = f"{pt}_{f}_{c}_{t}"
-                pastry_images[key] = pygame.image.load(f"pastry/{key}.png")
-
-class Piece:
-    def __init__(self, pastry_type, flavor, collection, topping):
-        self.pastry_type = pastry_type
-        self.flavor = flavor
-        self.collection = collection
-        self.topping = topping
-        self.image = pastry_images[f"{pastry_type}_{flavor}_{collection}_{topping}"]
-
-    def draw(self, x, y, size):
-        scaled_image = pygame.transform.scale(self.image, (size, size))
-        screen.blit(scaled_image, (x - size // 2, y - size // 2))
-
-class Board:
-    def __init__(self):
-        # Initialize 4* 4 board
-        self.grid = [[None for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
-
-    def place_piece(self, piece, row, col):
-        if self.grid[row][col] is None:
-            self.grid[row][col] = piece
-            return True
-        return False
 
-    def is_full(self):
-        # Check if all cells are filled
-        return all(all(cell is not None for cell in row) for row in self.grid)
-
-    def check_win(self):
-        # Check rows and column
-        for i in range(BOARD_SIZE):
-            if self.check_line(self.grid[i]) or self.check_line([self.grid[j][i] for j in range(BOARD_SIZE)]):
-                return True
-        # Check diagonals
-        if self.check_line([self.grid[i][i] for i in range(BOARD_SIZE)]) or \
-           self.check_line([self.grid[i][BOARD_SIZE-1-i] for i in range(BOARD_SIZE)]):
-            return True
-        return False
-    
-    def check_line(self, line):
-        if None in line:
-            return False
-        return any(all(getattr(piece, attr) == getattr(line[0], attr) for piece in line) for attr in ['pastry_type', 'flavor', 'collection', 'topping'])
-
-    def draw(self):
-        board_width = BOARD_SIZE * CELL_SIZE
-        board_start_x = (WINDOW_SIZE[0] - board_width) // 2 
-        board_start_y = (WINDOW_SIZE[1] - board_width) // 2
-
-        # Draw board
-        for row in range(BOARD_SIZE):
-            for col in range(BOARD_SIZE):
-                x = board_start_x + col * CELL_SIZE + CELL_SIZE // 2
-                y = board_start_y + row * CELL_SIZE + CELL_SIZE // 2
-                color = LIGHT_BUTTER if (row + col) % 2 == 0 else BLACK_BEAN
-                pygame.draw.rect(screen, color, (x - CELL_SIZE // 2, y - CELL_SIZE // 2, CELL_SIZE, CELL_SIZE))
-                if self.grid[row][col]:
-                    self.grid[row][col].draw(x, y, PIECE_SIZE)
-
-class QuartoAI:
-    def __init__(self, max_depth = 4):
-        # Initialize AI with maximum depth for minimax algorithm
-        self.max_depth = max_depth
-
-    def choose_piece(self, available_pieces):
-        # Randomly select a piece for the opponent
-        return random.choice(available_pieces)
-    
-    def get_best_move(self, board, piece):
-        # Initialize best scores as negative infinity and best move as None
-        best_score = float('-inf')
-        best_move = None
-
-        # Try each possible move on the board
-        for row in range(4):
-            for col in range(4):
-                # Check if the cell is empty
-                if board.grid[row][col] is None:
-                    # Create a deep copy of the board for simulation
-                    board_copy = self._copy_board(board)
-                    # Make the move on the copied board
-                    board_copy.place_piece(piece, row, col)
-
-
-                    # Calculate score using minimax
-                    score = self._minimax(board_copy, self.max_depth, False)
-
-                    # Update best move if current score is better
-                    if score > best_score:
-                        best_score = score
-                        best_move = (row, col)
-        return best_move
-    
-    def _minimax(self, board, depth, is_maximizing):
-        # Base case: check if game is over or maximum depth reached
-        if board.check_win():
-            return 100 if is_maximizing else -100
-        if board.is_full() or depth == 0:
-            return self._evaluate_board(board)
-        
-        if is_maximizing:
-            #Maximizing player's turn
-            max_eval = float('-inf')
-            for row in range(4):
-                for col in range(4):
-                    if board.grid[row][col] is None:
-                        #Try each possible move
-                        board_copy = self._copy_board(board)
-                        # Simulate a random piece placement (since actual piece isn't known)
-                        dummy_piece = self._create_dummy_piece()
-                        board_copy.place_piece(dummy_piece, row, col)
-                        eval = self._minimax(board_copy, depth- 1, False)
-                        max_eval = max(max_eval, eval)
-                    
-
-            return max_eval
-        else:
-            #Minimizing player's turn
-            min_eval = float('inf')
-            for row in range(4):
-                for col in range(4):
-                    if board.grid[row][col] is None:
-                        #Try each possible move
-                        board_copy = self._copy_board(board)
-                        # Simulate a random piece placement
-                        dummy_piece = self._create_dummy_piece()
-                        board_copy.place_piece(dummy_piece, row, col)
-                        eval = self._minimax(board_copy, depth- 1, True)
-                        min_eval = min(min_eval, eval)
-            return min_eval
-    
-    def _evaluate_board(self, board):
-        # Count potential winning lines and return a score
-        score = 0
-
-        # Check rows
-        for row in board.grid:
-            score += self._evaluate_line(row)
-
-        # Check col
-        for col in range(4):
-            column = [board.grid[row][col] for row in range(4)]
-            score += self._evaluate_line(column)
-
-        # Check diagonals
-        diag1 = [board.grid[i][i] for i in range(4)]
-        diag2 = [board.grid[i][3-i] for i in range(4)]
-        score += self._evaluate_line(diag1)
-        score += self._evaluate_line(diag2)
-        
-        return score
-    
-    def _evaluate_line(self, line):
-        # Count matching attributes in a line
-        if None in line or any(piece is None for piece in line):
-            return 0
-            
-        score = 0
-        attributes = ['pastry_type', 'flavor', 'collection', 'topping']
-        
-        for attr in attributes:
-            if all(getattr(piece, attr) == getattr(line[0], attr) for piece in line):
-                score += 1
-                
-        return score
-    
-    def _copy_board(self, board):
-        # Create a deep copy of the board
-        new_board = Board()
-        for i in range(4):
-            for j in range(4):
-                new_board.grid[i][j] = board.grid[i][j]
-        return new_board
-    
-    def _create_dummy_piece(self):
-        # Create a dummy piece for simulation purposes
-        return Piece(
-            random.choice(['Croissant', 'Eclair']),
-            random.choice(['Strawberry', 'Matcha']),
-            random.choice(['Traditional', 'Indulging']),
-            random.choice(['PowderSugar', 'WhippedCream'])
-        )
+from engine import Board, BOARD_SIZE, NUM_CELLS, PIECES, cell_index
+from Agent import QuartoAI
+from parallel import ParallelQuartoAI
+from worker import AIWorker, think
+from tablebase import Tablebase
+from book import OpeningBook
+from mcts import MCTSPlayer
+from Quarto import (WINDOW_SIZE, CELL_SIZE, PIECE_SIZE, MARGIN, PIECE_SELECTION_SIZE, WHITE, BLACK,
+                    LIGHT_BUTTER, BLACK_BEAN, TUSCAN_RED, OLIVEWOOD, font, title_font, prompt_font, button_font,
+                    use_bundle)
+from assets import AssetBundle
+from render import Renderer, SpriteCache
+from scheduler import FrameScheduler
+from client import GameClient
+from cache import ResultCache
+from gamelog import AI_FIRST, GameLog
+from tournament import close_engine
+
+AI_TIME_BUDGET = 0.3  # seconds per AI move
+AI_ENDGAME_EMPTIES = 6  # solve exactly once this few cells are left; more misses the time budget
+AI_ENGINES = ["Minimax", "MCTS"]  # picked on the start screen
+FPS = 30  # while animating; an idle screen waits for input instead
+DEBUG_KEY = pygame.K_F3  # shows the search and frame stats overlay
+# The same engines as tournament.py specs, for games played on a server
+AI_ENGINE_SPECS = {
+    "Minimax": f"minimax:time={AI_TIME_BUDGET},endgame={AI_ENDGAME_EMPTIES},book=1,cache=1",
+    "MCTS": f"mcts:time={AI_TIME_BUDGET}",
+}
+
+# Endgame tablebase and opening book (see tablebase.py, book.py). Both are
+# memory-mapped, so this is cheap and shared with other kiosk processes.
+# Each is None until it has been built.
+tablebase = Tablebase.open_default()
+opening_book = OpeningBook.open_default()
+# Backgrounds, pastries and font pre-scaled into one mapped file (see
+# assets.py); until it is built the PNGs are decoded and scaled at startup
+use_bundle(AssetBundle.open_default())
+
+# The game window and its renderer, set up by open_display() on the first draw
+screen = None
+renderer = None
+# Pastry sprites and backgrounds, scaled and converted once (see render.py)
+sprites = SpriteCache()
+
+
+def open_display():
+    global screen, renderer
+    if screen is None:
+        pygame.init()
+        screen = pygame.display.set_mode(WINDOW_SIZE)
+        pygame.display.set_caption("La Gourmandine Quarto")
+        renderer = Renderer(screen)
+    return screen
+
+def draw_piece(piece, x, y, size):
+    # Pieces are engine ids; their sprite is pre-scaled for each size
+    screen.blit(sprites.pastry(piece, size), (x - size // 2, y - size // 2))
+
+def draw_cell(row, col, piece):
+    board_width = BOARD_SIZE * CELL_SIZE
+    x = (WINDOW_SIZE[0] - board_width) // 2 + col * CELL_SIZE + CELL_SIZE // 2
+    y = (WINDOW_SIZE[1] - board_width) // 2 + row * CELL_SIZE + CELL_SIZE // 2
+    color = LIGHT_BUTTER if (row + col) % 2 == 0 else BLACK_BEAN
+    pygame.draw.rect(screen, color, (x - CELL_SIZE // 2, y - CELL_SIZE // 2, CELL_SIZE, CELL_SIZE))
+    if piece is not None:
+        draw_piece(piece, x, y, PIECE_SIZE)
+
+def draw_board(board):
+    # One region per cell, so placing a piece redraws just that cell
+    board_width = BOARD_SIZE * CELL_SIZE
+    board_start_x = (WINDOW_SIZE[0] - board_width) // 2 
+    board_start_y = (WINDOW_SIZE[1] - board_width) // 2
+    for row in range(BOARD_SIZE):
+        for col in range(BOARD_SIZE):
+            piece = board.piece_at(row, col)
+            rect = (board_start_x + col * CELL_SIZE, board_start_y + row * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+            renderer.region(("cell", row, col), rect, piece, lambda row=row, col=col, piece=piece: draw_cell(row, col, piece))
+
+def background_image():
+    return sprites.image("bg/2.png", WINDOW_SIZE)
+
+def prompt_image():
+    return sprites.image("bg/1.png", WINDOW_SIZE)
 
 class Button:
     def __init__(self, x, y, width, height, text, color):
@@ -251,7 +98,7 @@ class Button:
         color = self.hover_color if self.is_hovered else self.color
         pygame.draw.rect(screen, color, self.rect, border_radius=10)
         pygame.draw.rect(screen, OLIVEWOOD, self.rect, 3, border_radius=10)
-        text_surface, _ = button_font.render(self.text, OLIVEWOOD)
+        text_surface, _ = button_font().render(self.text, OLIVEWOOD)
         text_rect = text_surface.get_rect(center=self.rect.center)
         screen.blit(text_surface, text_rect)
 
@@ -264,7 +111,21 @@ class Button:
         return False
     
 class Game:
-    def __init__(self):
+    def __init__(self, workers = None):
+        # Runs AI turns in the background so the window keeps drawing
+        self.worker = AIWorker()
+        # Processes each Minimax search is split across (see parallel.py)
+        self.workers = workers
+        self.ai = None
+        # Debug overlay, toggled with DEBUG_KEY; main() keeps frame_stats
+        # up to date while it is shown
+        self.debug = False
+        self.frame_stats = None
+        # Every game, finished or not, goes to the game log (see gamelog.py)
+        # as the (cell, piece) of each placement
+        self.log = GameLog.open_default()
+        self.plies = []
+        self.engine = AI_ENGINES[0]
         self.reset_game()
         self.game_state = "start_screen"  # New state for start screen
         self.start_button = Button(
@@ -274,6 +135,13 @@ class Game:
             "Start Game",
             LIGHT_BUTTER
         )
+        self.engine_button = Button(
+            WINDOW_SIZE[0]//2 - 100,
+            WINDOW_SIZE[1]//2 + 50,
+            200, 60,
+            f"AI: {self.engine}",
+            LIGHT_BUTTER
+        )
         self.restart_button = Button(
             WINDOW_SIZE[0]//2 - 100,
             WINDOW_SIZE[1]//2 + 50,
@@ -281,59 +149,116 @@ class Game:
             "Play Again",
             LIGHT_BUTTER
         )
+        self.new_game_button = Button(
+            MARGIN // 2,
+            MARGIN // 2,
+            160, 50,
+            "Restart",
+            LIGHT_BUTTER
+        )
     
     def reset_game(self):
+        # Abandon an AI turn that is still being computed
+        self.worker.cancel()
+        self.log_game()
         self.board = Board()
-        self.available_pieces = [
-            Piece(pt, f, c, t)
-            for pt in ['Croissant', 'Eclair']
-            for f in ['Strawberry', 'Matcha']
-            for c in ['Traditional', 'Indulging']
-            for t in ['PowderSugar', 'WhippedCream']
-        ]
+        self.available_pieces = list(PIECES)
         self.current_player = 1
         self.selected_piece = None
         self.game_state = "select_piece"
-        self.ai = QuartoAI()
+        self.replace_ai()
         self.is_ai_turn = False
         self.result = None
 
+    def create_ai(self):
+        if self.engine == "MCTS":
+            # As many batched playouts as 300 ms per move allows
+            return MCTSPlayer(time_budget=AI_TIME_BUDGET)
+        # Deepen as far as 300 ms per move allows
+        # Searches are kept across games, restarts and other kiosk processes
+        options = dict(max_depth=NUM_CELLS, time_budget=AI_TIME_BUDGET,
+                       endgame_empties=AI_ENDGAME_EMPTIES, tablebase=tablebase,
+                       book=opening_book, cache=ResultCache.open_default())
+        if self.workers:
+            return ParallelQuartoAI(workers=self.workers, **options)
+        return QuartoAI(**options)
+
+    def replace_ai(self):
+        # The old AI's pool, if it has one, goes once its search has stopped
+        self.worker.cancel()
+        if self.ai is not None:
+            close_engine(self.ai)
+        self.ai = self.create_ai()
+
+    def next_engine(self):
+        # Cycle through AI_ENGINES from the start screen
+        self.engine = AI_ENGINES[(AI_ENGINES.index(self.engine) + 1) % len(AI_ENGINES)]
+        self.engine_button.text = f"AI: {self.engine}"
+        self.replace_ai()
+
     def draw_start_screen(self):
-        screen.blit(prompt_img, (0, 0))
         title_text = "La Gourmandine"
-        title_font.render_to(screen, (WINDOW_SIZE[0] // 2 - 180, WINDOW_SIZE[1] // 3), title_text, WHITE)
+        title_font().render_to(screen, (WINDOW_SIZE[0] // 2 - 180, WINDOW_SIZE[1] // 3), title_text, WHITE)
         prompt_text = "Welcome to the sweetest game of strategy!"
-        prompt_font.render_to(screen, (WINDOW_SIZE[0] // 2 - 200, WINDOW_SIZE[1] // 2 - 100), prompt_text, BLACK)
-        self.start_button.draw()
+        prompt_font().render_to(screen, (WINDOW_SIZE[0] // 2 - 200, WINDOW_SIZE[1] // 2 - 100), prompt_text, BLACK)
 
     def draw_game_over_screen(self):
         # Draw the game state as usual
-        self.draw_game_screen()
+        self.draw_game_screen(True)
         # Add a semi-transparent overlay
         overlay = pygame.Surface(WINDOW_SIZE)
         overlay.fill(WHITE)
         overlay.set_alpha(128)
         screen.blit(overlay, (0, 0))
-        # Draw the result and restart button
-        prompt_font.render_to(screen, (WINDOW_SIZE[0] // 2 - 100, WINDOW_SIZE[1] // 2 - 20), self.result, BLACK)
-        self.restart_button.draw()
+        # Draw the result; the restart button is a region over all this
+        prompt_font().render_to(screen, (WINDOW_SIZE[0] // 2 - 100, WINDOW_SIZE[1] // 2 - 20), self.result, BLACK)
+        renderer.snapshot()
+
+    def start_ai_turn(self):
+        # The AI places the piece it was given and picks one to hand back on
+        # the worker thread; the UI keeps drawing in the "ai_thinking" state
+        self.is_ai_turn = True
+        self.game_state = "ai_thinking"
+        self.worker.submit(self.ai, think, self.ai, self.board.copy(), self.selected_piece, list(self.available_pieces))
+
+    def start_pondering(self):
+        # Search the human's turn on the worker until the AI's own turn (or a
+        # reset) cancels it; the AI keeps what it found in its tables
+        if not isinstance(self.ai, QuartoAI) or self.board.filled == 0:
+            return
+        if self.game_state == "place_piece":
+            self.worker.submit(self.ai, self.ai.ponder, self.board.copy(), self.selected_piece)
+        elif self.game_state == "select_piece":
+            self.worker.submit(self.ai, self.ai.ponder, self.board.copy(), None, list(self.available_pieces))
+
+    def update_ai_turn(self):
+        # Apply the AI's move once the worker is done with it
+        if self.game_state != "ai_thinking":
+            return None
+        move = self.worker.result()
+        if move is None:
+            return None
+        return self.apply_ai_move(*move)
 
     def handle_ai_turn(self):
+        # Synchronous AI turn, for callers without a frame loop
         if self.is_ai_turn:
-            if self.game_state == "select_piece":
-                # AI chooses a piece for the opponent (human player)
-                self.selected_piece = self.ai.choose_piece(self.available_pieces)
-                self.available_pieces.remove(self.selected_piece)
-                self.game_state = "place_piece"
-                self.switch_player()  # AI switches to placement mode
-            elif self.game_state == "place_piece":
-                # AI decides where to place the piece
-                row, col = self.ai.get_best_move(self.board, self.selected_piece)
-                result = self.place_piece(row, col)
-                self.game_state = "select_piece"  # Switch back to piece selection after placing
-                self.switch_player()  # Switch back to the human player's turn
-                self.is_ai_turn = False
-                return result
+            # Pondering would share the AI with this search
+            self.worker.cancel()
+            return self.apply_ai_move(*think(self.ai, self.board.copy(), self.selected_piece, list(self.available_pieces)))
+        return None
+
+    def apply_ai_move(self, row, col, give):
+        self.is_ai_turn = False
+        result = self.place_piece(row, col)
+        if result:
+            return result
+        # AI chooses a piece for the opponent (human player)
+        self.selected_piece = PIECES[give]
+        self.available_pieces.remove(give)
+        self.game_state = "place_piece"
+        self.switch_player()  # Human places the piece next
+        self.start_pondering()
         return None
 
     
@@ -349,6 +274,12 @@ class Game:
 
     def place_piece(self, row, col):
         if self.board.place_piece(self.selected_piece, row, col):
+            self.plies.append((cell_index(row, col), self.selected_piece))
+            if self.board.check_win() or self.board.is_full():
+                self.log_game()
+                # Nothing is thinking or waiting for a move any more, so the
+                # frame loop can go idle on the game over screen
+                self.game_state = "game_over"
             if self.board.check_win():
                 return f"Player {self.current_player} wins!"
             elif self.board.is_full():
@@ -358,27 +289,129 @@ class Game:
         return None
     
     
-    def draw_game_screen(self):
-        screen.blit(background_img, (0, 0))
-        title_text = "La Gourmandine"
-        title_font.render_to(screen, (WINDOW_SIZE[0] // 2 - 180, 20), title_text, TUSCAN_RED)
-        self.board.draw()
-        self.draw_available_pieces()
-        if self.selected_piece:
-            self.selected_piece.draw(WINDOW_SIZE[0] - MARGIN - CELL_SIZE // 2, MARGIN + CELL_SIZE // 2, PIECE_SIZE)
-        if self.game_state == "select_piece":
+    def draw_game_screen(self, full):
+        # Everything but the title is a region (see render.py), redrawn only
+        # when what it shows changes
+        if full:
+            title_text = "La Gourmandine"
+            title_font().render_to(screen, (WINDOW_SIZE[0] // 2 - 180, 20), title_text, TUSCAN_RED)
+        draw_board(self.board)
+        tray_y = WINDOW_SIZE[1] - MARGIN - PIECE_SELECTION_SIZE
+        renderer.region("tray", (0, tray_y - PIECE_SELECTION_SIZE // 2 - 4, WINDOW_SIZE[0], PIECE_SELECTION_SIZE + 8),
+                        (tuple(self.available_pieces), self.game_state == "select_piece"), self.draw_available_pieces)
+        held_x = WINDOW_SIZE[0] - MARGIN - CELL_SIZE // 2
+        held_y = MARGIN + CELL_SIZE // 2
+        renderer.region("held", (held_x - PIECE_SIZE // 2, held_y - PIECE_SIZE // 2, PIECE_SIZE, PIECE_SIZE),
+                        self.selected_piece, self.draw_held_piece)
+        renderer.region("new_game", self.new_game_button.rect.inflate(4, 4),
+                        (not self.result, self.new_game_button.is_hovered), self.draw_new_game_button)
+        phase = None
+        if self.game_state == "ai_thinking":
+            prompt_text = f"Player {self.current_player} is picking a spot for your pastry"
+            phase = pygame.time.get_ticks() // 200 % 3
+        elif self.game_state == "select_piece":
             prompt_text = f"Player {self.current_player}, your friend would like a pastry!"
+        elif self.game_state == "game_over":
+            prompt_text = ""
         else:
             prompt_text = f"Player {self.current_player}, where would you want to place the selected pastry?"
-        prompt_font.render_to(screen, (WINDOW_SIZE[0] // 2 - 200, WINDOW_SIZE[1] - 720), prompt_text, OLIVEWOOD)
+        renderer.region("thinking", (held_x - 33, MARGIN + CELL_SIZE + 11, 66, 18), phase,
+                        lambda: self.draw_thinking_indicator(phase))
+        prompt_pos = (WINDOW_SIZE[0] // 2 - 200, WINDOW_SIZE[1] - 720)
+        prompt_rect = pygame.Rect(prompt_pos, prompt_font().get_rect(prompt_text).size).inflate(8, 8)
+        renderer.region("prompt", prompt_rect, prompt_text,
+                        lambda: prompt_font().render_to(screen, prompt_pos, prompt_text, OLIVEWOOD))
+        lines = tuple(self.debug_lines()) if self.debug else None
+        renderer.region("debug", (10, 110, 300, 20 * len(lines or ()) + 10), lines,
+                        lambda: self.draw_debug_overlay(lines))
+
+    def draw_held_piece(self):
+        if self.selected_piece is not None:
+            draw_piece(self.selected_piece, WINDOW_SIZE[0] - MARGIN - CELL_SIZE // 2, MARGIN + CELL_SIZE // 2, PIECE_SIZE)
+
+    def draw_new_game_button(self):
+        if not self.result:
+            self.new_game_button.draw()
+
+    def draw_thinking_indicator(self, phase):
+        # Three dots pulsing in turn next to the piece the AI is holding
+        if phase is None:
+            return
+        center_x = WINDOW_SIZE[0] - MARGIN - CELL_SIZE // 2
+        center_y = MARGIN + CELL_SIZE + 20
+        for i in range(3):
+            radius = 8 if phase == i else 5
+            pygame.draw.circle(screen, TUSCAN_RED, (center_x + (i - 1) * 24, center_y), radius)
+
+    def debug_lines(self):
+        # The last search's stats (whatever the engine reports) and frame times
+        lines = [f"engine {self.engine}"]
+        stats = getattr(self.ai, "last_stats", None) or {}
+        for name, value in stats.items():
+            if isinstance(value, float):
+                lines.append(f"{name} {value:.3g}")
+            elif isinstance(value, (int, str)) or value is None:
+                lines.append(f"{name} {value}")
+        if stats.get('time'):
+            lines.append(f"nodes/s {stats.get('nodes', 0) / stats['time']:.0f}")
+        ponder = getattr(self.ai, "ponder_stats", None)
+        if ponder:
+            lines.append(f"ponder depth {ponder['depth']} replies {ponder['pondered']}/{ponder['replies']} "
+                         f"nodes {ponder['nodes']}")
+        if self.frame_stats:
+            lines.append(f"fps {self.frame_stats['fps']:.0f}")
+            if 'frame_ms' in self.frame_stats:
+                lines.append(f"frame p95 {self.frame_stats['frame_ms']['p95']:.1f} ms")
+        return lines
+
+    def draw_debug_overlay(self, lines):
+        if lines is None:
+            return
+        panel = pygame.Surface((300, 20 * len(lines) + 10))
+        panel.fill(BLACK)
+        panel.set_alpha(160)
+        screen.blit(panel, (10, 110))
+        for i, line in enumerate(lines):
+            font(16).render_to(screen, (18, 118 + 20 * i), line, WHITE)
+
+    def log_game(self):
+        # The AI is always handed the first piece
+        if self.plies:
+            self.log.write(self.plies, AI_ENGINES.index(self.engine), AI_FIRST)
+            self.plies = []
+
+    def close(self):
+        self.worker.shutdown()
+        self.log_game()
+        self.log.close()
+        if self.ai is not None and getattr(self.ai, "cache", None) is not None:
+            self.ai.cache.flush_stats()
+        if self.ai is not None:
+            close_engine(self.ai)
+
+    def is_animating(self):
+        # The thinking indicator is the only thing that moves by itself
+        return self.game_state == "ai_thinking"
 
     def draw(self):
+        # Returns the screen rects that were updated
+        open_display()
         if self.game_state == "start_screen":
-            self.draw_start_screen()
+            if renderer.begin("start", prompt_image()):
+                self.draw_start_screen()
+            self.draw_button("start_button", self.start_button)
+            self.draw_button("engine_button", self.engine_button)
         elif self.result:
-            self.draw_game_over_screen()
+            if renderer.begin(("game_over", self.result), background_image()):
+                self.draw_game_over_screen()
+            self.draw_button("restart_button", self.restart_button)
         else:
-            self.draw_game_screen()
+            self.draw_game_screen(renderer.begin("game", background_image()))
+        return renderer.present()
+
+    def draw_button(self, name, button):
+        # Hovering or relabelling a button redraws just the button
+        renderer.region(name, button.rect.inflate(4, 4), (button.text, button.is_hovered), button.draw)
 
     def draw_available_pieces(self):
         # Draw available pieces at the bottom
@@ -389,24 +422,111 @@ class Game:
             y = start_y
             if self.game_state == "select_piece":
                 pygame.draw.rect(screen, LIGHT_BUTTER, (x - PIECE_SELECTION_SIZE // 2 - 4, y - PIECE_SELECTION_SIZE // 2 - 2, PIECE_SELECTION_SIZE + 4, PIECE_SELECTION_SIZE + 4))
-            piece.draw(x, y, PIECE_SELECTION_SIZE)
+            draw_piece(piece, x, y, PIECE_SELECTION_SIZE)
+
+class RemoteGame(Game):
+    # Front end for a game hosted by server.py: the rules and the AI run on
+    # the server, this only draws its state and forwards clicks
+    def __init__(self, client, workers = None):
+        self.client = client
+        super().__init__(workers)
+
+    def reset_game(self):
+        self.ai = None
+        spec = AI_ENGINE_SPECS[self.engine]
+        if self.workers and self.engine == "Minimax":
+            spec += f",workers={self.workers}"
+        state = self.client.request("new", engine=spec)
+        # States the server pushed for the previous game may still be queued
+        self.session = state['session']
+        self.apply_state(state)
+
+    def create_ai(self):
+        return None
+
+    def next_engine(self):
+        super().next_engine()
+        self.reset_game()
+
+    def apply_state(self, state):
+        board = Board()
+        for cell, piece in enumerate(state['cells']):
+            if piece is not None:
+                board.place(piece, cell)
+        self.board = board
+        self.available_pieces = [PIECES[piece] for piece in state['available']]
+        self.selected_piece = None if state['selected'] is None else PIECES[state['selected']]
+        self.current_player = state['current_player']
+        self.game_state = state['state']
+        self.result = state['result']
+        self.is_ai_turn = self.game_state == "ai_thinking"
+
+    def select_piece(self, index):
+        if index < len(self.available_pieces):
+            self.apply_state(self.client.request("select", piece=self.available_pieces[index]))
+
+    def start_ai_turn(self):
+        # The server started thinking as soon as it was handed the piece
+        pass
+
+    def update_ai_turn(self):
+        state = self.client.poll()
+        if state is not None:
+            self.apply_pushed(state)
+        return self.result
+
+    def handle_ai_turn(self):
+        # Wait for the server's move
+        while self.is_ai_turn:
+            self.apply_pushed(self.client.pushed.get())
+        return self.result
+
+    def apply_pushed(self, state):
+        # Only this game's states; older ones were pushed before a reset
+        if state['session'] == self.session:
+            self.apply_state(state)
+
+    def place_piece(self, row, col):
+        try:
+            self.apply_state(self.client.request("place", row=row, col=col))
+        except ValueError:
+            # Not a free cell
+            return None
+        return self.result
+
+    def close(self):
+        super().close()
+        self.client.close()
+
 
 def main():
-    game = Game()
-    result = None
+    parser = argparse.ArgumentParser(description="La Gourmandine Quarto")
+    parser.add_argument("--server", help="host:port of a server.py to play on instead of locally")
+    parser.add_argument("--workers", type=int, help="split each Minimax search across this many processes")
+    args = parser.parse_args()
+
+    open_display()
+    game = RemoteGame(GameClient.connect(args.server), args.workers) if args.server else Game(args.workers)
+    scheduler = FrameScheduler(FPS)
 
     while True:
-        for event in pygame.event.get():
+        # Blocks until there is input unless something is animating
+        for event in scheduler.next_events(game.is_animating()):
             if event.type == pygame.QUIT:
+                game.close()
                 pygame.quit()
                 sys.exit()
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 if game.game_state == "start_screen":
                     if game.start_button.handle_event(event):
                         game.game_state = "select_piece"
+                    elif game.engine_button.handle_event(event):
+                        game.next_engine()
                 elif game.result:
                     if game.restart_button.handle_event(event):
                         game.reset_game()
+                elif game.new_game_button.handle_event(event):
+                    game.reset_game()
                 elif not game.is_ai_turn:
                     x, y = pygame.mouse.get_pos()
                     if game.game_state == "select_piece":
@@ -418,6 +538,7 @@ def main():
                             if piece_x - PIECE_SELECTION_SIZE // 2 < x < piece_x + PIECE_SELECTION_SIZE // 2 and \
                             piece_y - PIECE_SELECTION_SIZE // 2 < y < piece_y + PIECE_SELECTION_SIZE // 2:
                                 game.select_piece(i)
+                                game.start_ai_turn()
                                 break
                     elif game.game_state == "place_piece":
                         board_width = BOARD_SIZE * CELL_SIZE
@@ -427,23 +548,29 @@ def main():
                         row = (y - board_start_y) // CELL_SIZE
                         if 0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE:
                             game.result = game.place_piece(row, col)
-                            if not game.result:
-                                game.is_ai_turn = True
+                            if not game.result and game.game_state == "select_piece":
+                                game.start_pondering()
+            elif event.type == pygame.KEYDOWN and event.key == DEBUG_KEY:
+                game.debug = not game.debug
             elif event.type == pygame.MOUSEMOTION:
                 if game.game_state == "start_screen":
                     game.start_button.handle_event(event)
+                    game.engine_button.handle_event(event)
                 elif game.result:
                     game.restart_button.handle_event(event)
+                else:
+                    game.new_game_button.handle_event(event)
 
         # Handle AI turns
-        if game.is_ai_turn and not result:
-            # AI places the piece chosen by the player and chooses a new piece for the player
-            result = game.handle_ai_turn()
+        if game.is_ai_turn and not game.result:
+            # Pick up the AI's move once the background search has finished
+            game.result = game.update_ai_turn()
 
+        if game.debug:
+            game.frame_stats = scheduler.stats()
+        # Only the regions that changed reach the display
         game.draw()
-
-        pygame.display.flip()
-        pygame.time.Clock().tick(30)
+        scheduler.end_frame()
 
 
 if __name__ == "__main__":
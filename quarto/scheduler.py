@@ -0,0 +1,70 @@
+# Frame pacing for the pygame main loop.
+# While something on screen moves (the AI thinking indicator) frames run at
+# the full rate; otherwise the loop sleeps in pygame.event.wait() until there
+# is input, so an idle kiosk uses next to no CPU.
+import time
+from collections import deque
+
+import pygame
+
+
+class FrameScheduler:
+    def __init__(self, fps = 30, idle_wake = None, window = 300):
+        self.fps = fps
+        # Seconds between wake-ups when idle; None sleeps until there is input
+        self.idle_wake = idle_wake
+        self.clock = pygame.time.Clock()
+        # Time spent producing each of the last window frames
+        self.frame_times = deque(maxlen=window)
+        self.frame_start = None
+        self.started = time.perf_counter()
+        self.frames = 0
+        self.animated_frames = 0
+        self.idle_waits = 0
+
+    def next_events(self, animating):
+        # Wait for the next frame and return the events to handle. animating
+        # says whether anything on screen changes without input.
+        if animating:
+            self.clock.tick(self.fps)
+            events = pygame.event.get()
+            self.animated_frames += 1
+        else:
+            self.idle_waits += 1
+            if self.idle_wake is None:
+                event = pygame.event.wait()
+            else:
+                event = pygame.event.wait(int(self.idle_wake * 1000))
+            events = [] if event.type == pygame.NOEVENT else [event]
+            events.extend(pygame.event.get())
+            # Don't count the sleep against the frame rate cap afterwards
+            self.clock.tick()
+        self.frame_start = time.perf_counter()
+        return events
+
+    def end_frame(self):
+        # Call once the frame has been drawn
+        if self.frame_start is not None:
+            self.frame_times.append(time.perf_counter() - self.frame_start)
+            self.frame_start = None
+        self.frames += 1
+
+    def stats(self):
+        # Frame count and rate since start, plus frame-time percentiles (ms)
+        # over the recent window
+        elapsed = time.perf_counter() - self.started
+        times = sorted(self.frame_times)
+        stats = {
+            'frames': self.frames,
+            'animated_frames': self.animated_frames,
+            'idle_waits': self.idle_waits,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+        }
+        if times:
+            stats['frame_ms'] = {
+                'mean': sum(times) / len(times) * 1000,
+                'p50': times[len(times) // 2] * 1000,
+                'p95': times[min(len(times) - 1, int(len(times) * 0.95))] * 1000,
+                'max': times[-1] * 1000,
+            }
+        return stats
@@ -0,0 +1,474 @@
+# Headless game server: many tables, one process, one shared AI pool.
+#
+#   python server.py serve --port 8765 --workers 4
+#   python server.py simulate --clients 200 --games 2 --engine minimax:depth=2
+#
+# Each TCP connection is one table playing one game at a time. Messages are
+# JSON objects, one per line each way. Requests carry an "id" that their
+# reply echoes; the state pushed once the AI has moved has no id.
+#
+#   {"id": 1, "op": "new", "engine": "minimax:time=0.3"}   start a game (engine optional)
+#   {"id": 2, "op": "select", "piece": 5}                  hand the AI a piece
+#   {"id": 3, "op": "place", "row": 1, "col": 2}           place the piece the AI gave
+#   {"id": 4, "op": "metrics"}                             AI pool and server counters
+#
+# Replies are {"op": "state", ...} (see Session.to_dict), {"op": "metrics",
+# ...} or {"op": "error", "message": ...}. Engines are tournament.py specs,
+# checked by new. If the AI fails to move, the pushed state is the one
+# before the select, with an "error" message: the piece is back on offer.
+# AI moves run on a process pool shared by every table. Tables take turns
+# (round robin) for free workers, so a busy table can't starve the others.
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from engine import Board, BOARD_SIZE, NUM_CELLS, NUM_PIECES, cell_index, cell_position
+from tournament import make_engine, parse_engine, percentile
+from worker import think
+
+DEFAULT_ENGINE = "minimax:time=0.3,endgame=6,book=1,cache=1"
+
+# Engines of a pool worker process, one per spec, shared by every table the
+# process serves. Their tables hold canonical positions, so sharing is safe.
+_engines = {}
+
+
+def _ai_turn(spec, placements, piece, available):
+    # Runs in a pool worker: rebuild the board and play one AI turn
+    engine = _engines.get(spec)
+    if engine is None:
+        engine = _engines[spec] = make_engine(spec, None)
+    board = Board()
+    for placed, cell in placements:
+        board.place(placed, cell)
+    return think(engine, board, piece, available)
+
+
+class Session:
+    # One table's game; the same turn order as runner.Game: the human hands
+    # the AI a piece, the AI places it and hands one back, the human places it
+    def __init__(self, session_id, engine):
+        self.session_id = session_id
+        self.engine = engine
+        self.board = Board()
+        self.placements = []
+        self.available_pieces = list(range(NUM_PIECES))
+        self.selected_piece = None
+        self.current_player = 1
+        self.game_state = "select_piece"
+        self.result = None
+        self.ai_task = None
+
+    def select(self, piece):
+        if self.game_state != "select_piece":
+            raise ValueError(f"can't select a piece in state {self.game_state}")
+        if piece not in self.available_pieces:
+            raise ValueError(f"piece {piece} is not available")
+        self.available_pieces.remove(piece)
+        self.selected_piece = piece
+        self.game_state = "ai_thinking"
+        self.current_player = 3 - self.current_player
+
+    def place(self, row, col):
+        if self.game_state != "place_piece":
+            raise ValueError(f"can't place a piece in state {self.game_state}")
+        if not (0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE):
+            raise ValueError(f"cell {(row, col)} is off the board")
+        self._place(row, col)
+        if self.result is None:
+            self.selected_piece = None
+            self.game_state = "select_piece"
+
+    def apply_ai_move(self, row, col, give):
+        self._place(row, col)
+        if self.result is None:
+            self.selected_piece = give
+            self.available_pieces.remove(give)
+            self.game_state = "place_piece"
+            self.current_player = 3 - self.current_player
+
+    def ai_failed(self):
+        # Undo the select the AI couldn't answer, so the human can offer a
+        # piece again
+        self.available_pieces = sorted(self.available_pieces + [self.selected_piece])
+        self.selected_piece = None
+        self.game_state = "select_piece"
+        self.current_player = 3 - self.current_player
+
+    def _place(self, row, col):
+        if not self.board.place_piece(self.selected_piece, row, col):
+            raise ValueError(f"cell {(row, col)} is not free")
+        self.placements.append((self.selected_piece, cell_index(row, col)))
+        if self.board.check_win():
+            self.result = f"Player {self.current_player} wins!"
+        elif self.board.is_full():
+            self.result = "It's a draw!"
+        if self.result is not None:
+            self.game_state = "game_over"
+
+    def ai_request(self):
+        return self.engine, list(self.placements), self.selected_piece, list(self.available_pieces)
+
+    def to_dict(self):
+        return {
+            'op': 'state',
+            'session': self.session_id,
+            'engine': self.engine,
+            'cells': [self.board.piece_at_cell(cell) for cell in range(NUM_CELLS)],
+            'available': self.available_pieces,
+            'selected': self.selected_piece,
+            'current_player': self.current_player,
+            'state': self.game_state,
+            'result': self.result,
+        }
+
+
+class AIPool:
+    # Bounded pool of AI workers with one queue per table, served round robin
+    def __init__(self, workers, executor = None):
+        self.workers = workers
+        # A pool we made is replaced if a worker dies (see _finished)
+        self.owns_executor = executor is None
+        self.executor = executor or self._new_executor()
+        # session id -> deque of (future, args, queued at)
+        self.queues = {}
+        # Sessions with queued work, in the order they get the next free worker
+        self.ready = deque()
+        self.running = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=1000)
+        self.service_times = deque(maxlen=1000)
+
+    def _new_executor(self):
+        # Spawned rather than forked: a forked worker would inherit the open
+        # client sockets and keep connections alive after tables hang up
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, session_id, *args):
+        # Returns a future for (row, col, give)
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.get(session_id)
+        if queue is None:
+            queue = self.queues[session_id] = deque()
+            self.ready.append(session_id)
+        queue.append((future, args, time.perf_counter()))
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        self._dispatch()
+        return future
+
+    def cancel(self, session_id):
+        # Drop a table's queued work, e.g. when it disconnects
+        queue = self.queues.pop(session_id, None)
+        if queue is None:
+            return
+        self.ready.remove(session_id)
+        self.queued -= len(queue)
+        for future, _, _ in queue:
+            future.cancel()
+
+    def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while self.running < self.workers and self.ready:
+            session_id = self.ready.popleft()
+            queue = self.queues[session_id]
+            future, args, queued_at = queue.popleft()
+            if queue:
+                # Back of the line for its next job
+                self.ready.append(session_id)
+            else:
+                del self.queues[session_id]
+            self.queued -= 1
+            if future.cancelled():
+                continue
+            started = time.perf_counter()
+            self.wait_times.append(started - queued_at)
+            self.running += 1
+            job = loop.run_in_executor(self.executor, _ai_turn, *args)
+            job.add_done_callback(lambda job, future=future, started=started, executor=self.executor:
+                                  self._finished(job, future, started, executor))
+
+    def _finished(self, job, future, started, executor):
+        self.running -= 1
+        self.service_times.append(time.perf_counter() - started)
+        if job.exception() is not None:
+            self.failed += 1
+            if isinstance(job.exception(), BrokenProcessPool) and executor is self.executor and self.owns_executor:
+                # A worker died, which breaks the whole pool; later turns
+                # get a fresh one
+                executor.shutdown(wait=False)
+                self.executor = self._new_executor()
+            if not future.cancelled():
+                future.set_exception(job.exception())
+        else:
+            self.completed += 1
+            if not future.cancelled():
+                future.set_result(job.result())
+        self._dispatch()
+
+    def metrics(self):
+        def summary(times):
+            if not times:
+                return None
+            return {'mean': sum(times) / len(times) * 1000, 'p95': percentile(times, 95) * 1000}
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'sessions_waiting': len(self.queues),
+            'completed': self.completed,
+            'failed': self.failed,
+            'wait_ms': summary(self.wait_times),
+            'service_ms': summary(self.service_times),
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+class GameServer:
+    def __init__(self, pool, default_engine = DEFAULT_ENGINE):
+        self.pool = pool
+        self.default_engine = default_engine
+        self.next_session = 1
+        self.sessions = {}
+        self.connections = 0
+        self.games_started = 0
+        self.games_finished = 0
+
+    async def start(self, host, port):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        session = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                    request_id = request.get('id')
+                    session, reply = self.dispatch(session, request, writer)
+                except (ValueError, KeyError, TypeError) as exc:
+                    reply = {'op': 'error', 'message': str(exc)}
+                reply['id'] = request_id
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            if session is not None:
+                self._close_session(session)
+            writer.close()
+
+    def dispatch(self, session, request, writer):
+        # Returns (session, reply) for one request
+        op = request['op']
+        if op == 'metrics':
+            return session, self.metrics()
+        if op == 'new':
+            engine = request.get('engine') or self.default_engine
+            # A bad spec is refused here rather than failing in a worker
+            parse_engine(engine)
+            if session is not None:
+                self._close_session(session)
+            session = Session(self.next_session, engine)
+            self.next_session += 1
+            self.sessions[session.session_id] = session
+            self.games_started += 1
+            return session, session.to_dict()
+        if session is None:
+            raise ValueError("no game; send new first")
+        if op == 'select':
+            session.select(int(request['piece']))
+            session.ai_task = asyncio.ensure_future(self._ai_turn(session, writer))
+        elif op == 'place':
+            session.place(int(request['row']), int(request['col']))
+        else:
+            raise ValueError(f"unknown op {op!r}")
+        if session.result is not None:
+            self.games_finished += 1
+        return session, session.to_dict()
+
+    async def _ai_turn(self, session, writer):
+        try:
+            row, col, give = await self.pool.submit(session.session_id, *session.ai_request())
+        except asyncio.CancelledError:
+            return
+        except Exception as exc:
+            session.ai_failed()
+            state = dict(session.to_dict(), error=f"AI move failed: {exc!r}")
+        else:
+            session.apply_ai_move(row, col, give)
+            if session.result is not None:
+                self.games_finished += 1
+            state = session.to_dict()
+        writer.write(json.dumps(state).encode() + b"\n")
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _close_session(self, session):
+        self.pool.cancel(session.session_id)
+        if session.ai_task is not None:
+            session.ai_task.cancel()
+        self.sessions.pop(session.session_id, None)
+
+    def metrics(self):
+        return {
+            'op': 'metrics',
+            'connections': self.connections,
+            'sessions': len(self.sessions),
+            'games_started': self.games_started,
+            'games_finished': self.games_finished,
+            'pool': self.pool.metrics(),
+        }
+
+
+async def serve(host, port, workers, engine):
+    pool = AIPool(workers)
+    server = GameServer(pool, engine)
+    listener = await server.start(host, port)
+    print(f"serving on {', '.join(str(s.getsockname()) for s in listener.sockets)} with {workers} AI workers")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        pool.shutdown()
+
+
+class _SimulatedTable:
+    # A client that plays random legal moves as fast as the server answers
+    def __init__(self, reader, writer, rng):
+        self.reader = reader
+        self.writer = writer
+        self.rng = rng
+        self.next_id = 1
+
+    async def request(self, op, **fields):
+        request_id = self.next_id
+        self.next_id += 1
+        self.writer.write(json.dumps(dict(fields, op=op, id=request_id)).encode() + b"\n")
+        await self.writer.drain()
+        reply = json.loads(await self.reader.readline())
+        if reply['op'] == 'error':
+            raise RuntimeError(reply['message'])
+        return reply
+
+    async def push(self):
+        return json.loads(await self.reader.readline())
+
+    async def play(self, engine, ai_latencies):
+        state = await self.request('new', engine=engine)
+        while state['result'] is None:
+            if state['state'] == 'select_piece':
+                started = time.perf_counter()
+                await self.request('select', piece=self.rng.choice(state['available']))
+                state = await self.push()
+                if 'error' in state:
+                    raise RuntimeError(state['error'])
+                ai_latencies.append(time.perf_counter() - started)
+            else:
+                empty = [cell for cell, piece in enumerate(state['cells']) if piece is None]
+                row, col = cell_position(self.rng.choice(empty))
+                state = await self.request('place', row=row, col=col)
+        return state['result']
+
+
+async def simulate(clients, games, engine, workers, seed, host = None, port = None):
+    # Drive clients tables concurrently, each playing games games. Starts a
+    # server on a free localhost port unless host/port are given.
+    pool = server = listener = None
+    if port is None:
+        pool = AIPool(workers)
+        server = GameServer(pool, engine)
+        listener = await server.start("127.0.0.1", 0)
+        host, port = "127.0.0.1", listener.sockets[0].getsockname()[1]
+    ai_latencies = []
+    results = []
+
+    async def table(index):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 16)
+        client = _SimulatedTable(reader, writer, random.Random(seed + index))
+        for _ in range(games):
+            results.append(await client.play(engine, ai_latencies))
+        metrics = await client.request('metrics')
+        writer.close()
+        await writer.wait_closed()
+        return metrics
+
+    started = time.perf_counter()
+    metrics = (await asyncio.gather(*(table(i) for i in range(clients))))[-1]
+    elapsed = time.perf_counter() - started
+    if listener is not None:
+        # Let the server see every table hang up before shutting it down
+        while server.connections:
+            await asyncio.sleep(0.01)
+        listener.close()
+        await listener.wait_closed()
+        pool.shutdown()
+
+    ai_wins = sum(1 for result in results if result == "Player 2 wins!")
+    draws = sum(1 for result in results if result == "It's a draw!")
+    print(f"{clients} tables x {games} games = {len(results)} games in {elapsed:.1f}s "
+          f"({len(results) / elapsed:.1f} games/s), AI won {ai_wins}, {draws} draws")
+    print(f"AI turn latency seen by tables: p50 {percentile(ai_latencies, 50) * 1000:.1f} ms  "
+          f"p95 {percentile(ai_latencies, 95) * 1000:.1f} ms  p99 {percentile(ai_latencies, 99) * 1000:.1f} ms")
+    pool_metrics = metrics['pool']
+    print(f"pool: {pool_metrics['workers']} workers, {pool_metrics['completed']} moves, "
+          f"max queue depth {pool_metrics['max_queued']}, "
+          f"mean wait {pool_metrics['wait_ms']['mean']:.1f} ms, mean service {pool_metrics['service_ms']['mean']:.1f} ms")
+    return results, ai_latencies, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-table Quarto game server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--engine", default=DEFAULT_ENGINE, help="engine for tables that don't pick one")
+    simulate_parser = commands.add_parser("simulate", help="drive simulated tables against a server")
+    simulate_parser.add_argument("--clients", type=int, default=100)
+    simulate_parser.add_argument("--games", type=int, default=1, help="games per table")
+    simulate_parser.add_argument("--engine", default="minimax:depth=2")
+    simulate_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    simulate_parser.add_argument("--seed", type=int, default=0)
+    simulate_parser.add_argument("--connect", help="host:port of a running server instead of a private one")
+    args = parser.parse_args()
+
+    try:
+        parse_engine(args.engine)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if args.command == "serve":
+        asyncio.run(serve(args.host, args.port, args.workers, args.engine))
+    else:
+        host = port = None
+        if args.connect:
+            host, _, port = args.connect.rpartition(":")
+            port = int(port)
+        asyncio.run(simulate(args.clients, args.games, args.engine, args.workers, args.seed, host, port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Canonical forms of Quarto positions.
+# Two positions are equivalent when one maps onto the other by a cell
+# permutation that keeps the 10 lines intact (rotations, reflections, the
+# inside-out and middle-swap transforms: 32 in total), combined with any
+# permutation of the four attributes and complementing any of them.
+# canonical() picks one representative key per class of equivalent positions.
+from engine import Board, BOARD_SIZE, FULL_BOARD, NUM_CELLS, cell_index
+
+
+def _cell_map(f):
+    return tuple(cell_index(*f(*divmod(cell, BOARD_SIZE))) for cell in range(NUM_CELLS))
+
+
+def _symmetry_group():
+    swap_middle = [0, 2, 1, 3]
+    inside_out = [1, 0, 3, 2]
+    generators = [
+        _cell_map(lambda r, c: (c, BOARD_SIZE - 1 - r)),        # rotation
+        _cell_map(lambda r, c: (c, r)),                          # reflection
+        _cell_map(lambda r, c: (swap_middle[r], swap_middle[c])),
+        _cell_map(lambda r, c: (inside_out[r], inside_out[c])),
+    ]
+    identity = tuple(range(NUM_CELLS))
+    group = {identity}
+    frontier = [identity]
+    while frontier:
+        perm = frontier.pop()
+        for gen in generators:
+            composed = tuple(gen[perm[cell]] for cell in range(NUM_CELLS))
+            if composed not in group:
+                group.add(composed)
+                frontier.append(composed)
+    # Identity first, then a fixed order so canonical transforms are reproducible
+    return [identity] + sorted(group - {identity})
+
+
+# CELL_SYMMETRIES[g][cell] is where symmetry g sends cell
+CELL_SYMMETRIES = _symmetry_group()
+INVERSE_SYMMETRIES = [tuple(perm.index(cell) for cell in range(NUM_CELLS)) for perm in CELL_SYMMETRIES]
+
+# 16-bit cell masks are permuted a byte at a time through lookup tables
+_MASK_LOW = []
+_MASK_HIGH = []
+for _perm in CELL_SYMMETRIES:
+    _MASK_LOW.append([sum(1 << _perm[i] for i in range(8) if (byte >> i) & 1) for byte in range(256)])
+    _MASK_HIGH.append([sum(1 << _perm[i + 8] for i in range(8) if (byte >> i) & 1) for byte in range(256)])
+_MASK_TABLES = list(zip(_MASK_LOW, _MASK_HIGH))
+
+_ATTRIBUTE_WIDTH = NUM_CELLS + 1
+_ATTRIBUTE_FIELD = (1 << _ATTRIBUTE_WIDTH) - 1
+
+
+def transform_mask(mask, g):
+    low, high = _MASK_TABLES[g]
+    return low[mask & 0xFF] | high[mask >> 8]
+
+
+def _attribute_values(board, occupied, low, high, piece):
+    # One 17-bit value per attribute bit: the cells holding a 1, plus the bit
+    # of the piece in hand. Complementing an attribute gives the other choice;
+    # the smaller one is taken so both halves of the class look the same.
+    values = []
+    complemented = 0
+    for b in range(4):
+        bits = board.bits[b]
+        mask = low[bits & 0xFF] | high[bits >> 8]
+        if piece is None:
+            plain = mask << 1
+            flipped = (occupied ^ mask) << 1
+        else:
+            hand = (piece >> b) & 1
+            plain = (mask << 1) | hand
+            flipped = ((occupied ^ mask) << 1) | (hand ^ 1)
+        if flipped < plain:
+            values.append((flipped, b))
+            complemented |= 1 << b
+        else:
+            values.append((plain, b))
+    # Sorting the attributes makes the key independent of their order
+    values.sort()
+    return values, complemented
+
+
+def _pack(occupied, values, piece):
+    key = 1 if piece is not None else 0
+    key = (key << NUM_CELLS) | occupied
+    for value, _ in values:
+        key = (key << _ATTRIBUTE_WIDTH) | value
+    return key
+
+
+def _candidates(board):
+    # The occupancy mask is the most significant part of the key, so only the
+    # symmetries giving the smallest transformed occupancy can win
+    occupied = board.occupied
+    best = None
+    candidates = []
+    for g, (low, high) in enumerate(_MASK_TABLES):
+        mask = low[occupied & 0xFF] | high[occupied >> 8]
+        if best is None or mask < best:
+            best = mask
+            candidates = [g]
+        elif mask == best:
+            candidates.append(g)
+    return best, candidates
+
+
+def canonical(board, piece=None):
+    # Key shared by every position equivalent to (board, piece in hand)
+    return canonical_transform(board, piece)[0]
+
+
+def canonical_transform(board, piece=None):
+    # Returns (key, sym) where sym maps cells and pieces of this position into
+    # the canonical frame (see to_canonical_cell / to_canonical_piece)
+    occupied, candidates = _candidates(board)
+    best_key = None
+    best_sym = None
+    for g in candidates:
+        low, high = _MASK_TABLES[g]
+        values, complemented = _attribute_values(board, occupied, low, high, piece)
+        key = _pack(occupied, values, piece)
+        if best_key is None or key < best_key:
+            best_key = key
+            best_sym = (g, complemented, tuple(b for _, b in values))
+    return best_key, best_sym
+
+
+def to_canonical_cell(sym, cell):
+    return CELL_SYMMETRIES[sym[0]][cell]
+
+
+def from_canonical_cell(sym, cell):
+    return INVERSE_SYMMETRIES[sym[0]][cell]
+
+
+def to_canonical_piece(sym, piece):
+    _, complemented, order = sym
+    piece ^= complemented
+    # Canonical bit j is the attribute that sorted into slot j
+    return sum(((piece >> b) & 1) << j for j, b in enumerate(order))
+
+
+def from_canonical_piece(sym, piece):
+    _, complemented, order = sym
+    original = sum(((piece >> j) & 1) << b for j, b in enumerate(order))
+    return original ^ complemented
+
+
+def decode(key):
+    # Rebuild (board, piece in hand) in the canonical frame from a key
+    values = []
+    for _ in range(4):
+        values.append(key & _ATTRIBUTE_FIELD)
+        key >>= _ATTRIBUTE_WIDTH
+    values.reverse()
+    occupied = key & FULL_BOARD
+    board = Board()
+    for cell in range(NUM_CELLS):
+        if (occupied >> cell) & 1:
+            board.place(sum(((values[j] >> (cell + 1)) & 1) << j for j in range(4)), cell)
+    piece = None
+    if key >> NUM_CELLS:
+        piece = sum((values[j] & 1) << j for j in range(4))
+    return board, piece
@@ -0,0 +1,299 @@
+# Exact endgame solver and its on-disk tablebase.
+# Below a handful of empty cells Quarto can be solved outright, so QuartoAI
+# hands those positions to EndgameSolver instead of the heuristic. Solved
+# positions are stored by canonical key (see symmetry.py) in a sorted binary
+# file that is memory-mapped, so every kiosk process on a machine shares one
+# copy from the page cache and opening it costs nothing up front.
+#
+#   python tablebase.py build --empties 8 --games 500 --out endgame.qtb
+#   python tablebase.py verify endgame.qtb --samples 300
+#
+# Every position with that few empty cells can't be enumerated (there are far
+# too many even up to symmetry), so build plays random games down to the
+# threshold, solves where they end up and keeps every exactly solved position
+# the solver went through.
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+from engine import Board, NUM_CELLS, NUM_PIECES
+from symmetry import canonical, decode
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "endgame.qtb")
+
+# File layout: header, then fixed-size records sorted by key. A record is the
+# 16-byte big-endian canonical key (so bytes compare like the numbers) and one
+# byte holding the value + 1 (0 loss, 1 draw, 2 win for the player to move).
+_MAGIC = b"QTB1"
+_HEADER = struct.Struct(">4sII")   # magic, record count, empties threshold
+_KEY_BYTES = 16
+_RECORD_BYTES = _KEY_BYTES + 1
+
+
+def find_record(data, offset, record_bytes, count, target):
+    # Index of the record starting with the bytes target in a file of count
+    # sorted fixed-size records from offset, or None
+    size = len(target)
+    low, high = 0, count
+    while low < high:
+        mid = (low + high) // 2
+        start = offset + mid * record_bytes
+        if data[start:start + size] < target:
+            low = mid + 1
+        else:
+            high = mid
+    start = offset + low * record_bytes
+    if low < count and data[start:start + size] == target:
+        return low
+    return None
+
+
+class EndgameSolver:
+    # Win (1), draw (0) or loss (-1) for the player about to place a piece,
+    # by alpha-beta over the full remaining game
+
+    def __init__(self, tablebase = None, table_size = 1 << 18, check = None, record = None):
+        self.tablebase = tablebase
+        self.table = TranspositionTable(table_size)
+        # Called every 256 nodes; may raise to abandon the solve
+        self.check = check
+        # When given, every exactly solved position is added to it (key -> value)
+        self.record = record
+        self.nodes = 0
+
+    def solve(self, board, piece):
+        return self._solve(board, piece, -1, 1)
+
+    def best_move(self, board, piece):
+        # Returns (value, (cell, give)); give is None when the placement ends the game
+        cell = board.winning_cell(piece)
+        if cell is not None:
+            return 1, (cell, None)
+        if board.filled == NUM_CELLS - 1:
+            return 0, (board.empty_cells()[0], None)
+        best_value = -2
+        best_move = None
+        for cell in board.empty_cells():
+            board.place(piece, cell)
+            gives = board.safe_gives()
+            while gives:
+                give = (gives & -gives).bit_length() - 1
+                gives &= gives - 1
+                value = -self._solve(board, give, -1, -best_value)
+                if value > best_value:
+                    best_value = value
+                    best_move = (cell, give)
+            board.undo()
+            if best_value == 1:
+                break
+        if best_move is None:
+            # Every placement hands over a winning piece
+            cell = board.empty_cells()[0]
+            board.place(piece, cell)
+            best_move = (cell, board.remaining_pieces()[0])
+            board.undo()
+            best_value = -1
+        return best_value, best_move
+
+    def _solve(self, board, piece, alpha, beta):
+        self.nodes += 1
+        if self.check is not None and not self.nodes & 255:
+            self.check()
+        if board.winning_cell(piece) is not None:
+            return 1
+        if board.filled == NUM_CELLS - 1:
+            return 0
+
+        key = canonical(board, piece)
+        if self.tablebase is not None:
+            value = self.tablebase.lookup(key)
+            if value is not None:
+                return value
+        entry = self.table.probe(key)
+        if entry is not None:
+            flag, value = entry[2], entry[3]
+            if flag == EXACT:
+                return value
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+
+        alpha_orig = alpha
+        # With no safe give anywhere the opponent wins next turn
+        best = -1
+        # The placement is kept while its gives are searched (safe_moves()
+        # would take it back)
+        for cell in board.empty_cells():
+            board.place(piece, cell)
+            gives = board.safe_gives()
+            while gives:
+                give = (gives & -gives).bit_length() - 1
+                gives &= gives - 1
+                value = -self._solve(board, give, -beta, -alpha)
+                if value > best:
+                    best = value
+                    if best > alpha:
+                        alpha = best
+                if alpha >= beta:
+                    break
+            board.undo()
+            if alpha >= beta:
+                break
+
+        if best <= alpha_orig:
+            flag = UPPER
+        elif best >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if (flag == UPPER and best == -1) or (flag == LOWER and best == 1):
+            # A bound at the end of the scale is the exact value
+            flag = EXACT
+        self.table.store(key, 0, flag, best)
+        if flag == EXACT and self.record is not None:
+            self.record[key] = best
+        return best
+
+
+class Tablebase:
+    def __init__(self, path = TABLEBASE_PATH):
+        self.path = path
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.empties = _HEADER.unpack_from(self.data, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Quarto tablebase")
+        self.probes = 0
+        self.hits = 0
+
+    @classmethod
+    def open_default(cls):
+        # The shipped tablebase, or None when it hasn't been built
+        if not os.path.exists(TABLEBASE_PATH):
+            return None
+        return cls(TABLEBASE_PATH)
+
+    def __len__(self):
+        return self.count
+
+    def key_at(self, index):
+        start = _HEADER.size + index * _RECORD_BYTES
+        return self.data[start:start + _KEY_BYTES]
+
+    def value_at(self, index):
+        return self.data[_HEADER.size + index * _RECORD_BYTES + _KEY_BYTES] - 1
+
+    def lookup(self, key):
+        # Binary search over the mapped records
+        self.probes += 1
+        index = find_record(self.data, _HEADER.size, _RECORD_BYTES, self.count, key.to_bytes(_KEY_BYTES, "big"))
+        if index is None:
+            return None
+        self.hits += 1
+        return self.value_at(index)
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def write_tablebase(path, positions, empties):
+    # positions maps canonical key -> value. Written to a temporary file and
+    # renamed, so running processes never map a half-written table.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(positions), empties))
+        for key in sorted(positions):
+            f.write(key.to_bytes(_KEY_BYTES, "big"))
+            f.write(bytes([positions[key] + 1]))
+    os.replace(tmp_path, path)
+
+
+def random_endgame(empties, rng):
+    # Play random moves (never handing over a winning piece when avoidable)
+    # until only `empties` cells are left. Returns (board, piece) or None if
+    # the game ended first.
+    board = Board()
+    piece = rng.randrange(NUM_PIECES)
+    while NUM_CELLS - board.filled > empties:
+        if board.winning_cell(piece) is not None:
+            return None
+        board.place(piece, rng.choice(board.empty_cells()))
+        remaining = board.remaining_pieces()
+        piece = rng.choice(board.safe_pieces(remaining) or remaining)
+    return board, piece
+
+
+def build(path, empties, games, seed):
+    rng = random.Random(seed)
+    positions = {}
+    solver = EndgameSolver(record=positions)
+    start = time.perf_counter()
+    solved = 0
+    while solved < games:
+        endgame = random_endgame(empties, rng)
+        if endgame is None:
+            continue
+        board, piece = endgame
+        value = solver.solve(board, piece)
+        positions[canonical(board, piece)] = value
+        solved += 1
+    write_tablebase(path, positions, empties)
+    elapsed = time.perf_counter() - start
+    print(f"solved {games} endgames with {empties} empty cells in {elapsed:.1f}s "
+          f"({solver.nodes} nodes), wrote {len(positions)} positions to {path}")
+
+
+def verify(path, samples, seed):
+    # Check the file is sorted and re-solve a sample of entries from scratch
+    tablebase = Tablebase(path)
+    previous = None
+    for index in range(len(tablebase)):
+        key = tablebase.key_at(index)
+        if previous is not None and key <= previous:
+            raise SystemExit(f"record {index} is out of order")
+        previous = key
+    rng = random.Random(seed)
+    solver = EndgameSolver()
+    wrong = 0
+    count = min(samples, len(tablebase))
+    for index in rng.sample(range(len(tablebase)), count):
+        key = int.from_bytes(tablebase.key_at(index), "big")
+        board, piece = decode(key)
+        if solver.solve(board, piece) != tablebase.value_at(index):
+            wrong += 1
+    tablebase.close()
+    print(f"{path}: {len(tablebase)} positions, sorted, {count - wrong}/{count} sampled values re-solved correctly")
+    if wrong:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify the Quarto endgame tablebase")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="solve random endgames and write the table")
+    build_parser.add_argument("--empties", type=int, default=8, help="empty cells at the solved positions")
+    build_parser.add_argument("--games", type=int, default=500, help="number of endgames to solve")
+    build_parser.add_argument("--seed", type=int, default=0)
+    build_parser.add_argument("--out", default=TABLEBASE_PATH)
+    verify_parser = commands.add_parser("verify", help="check ordering and re-solve sampled entries")
+    verify_parser.add_argument("path", nargs="?", default=TABLEBASE_PATH)
+    verify_parser.add_argument("--samples", type=int, default=300)
+    verify_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.command == "build":
+        build(args.out, args.empties, args.games, args.seed)
+    else:
+        verify(args.path, args.samples, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Headless checks of the pygame front end: python -m pytest test_runner.py
+import os
+import queue
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import pytest
+
+import runner
+from engine import PIECES
+from gamelog import GameLog
+
+
+@pytest.fixture
+def game(tmp_path, monkeypatch):
+    monkeypatch.setattr(GameLog, "open_default", classmethod(lambda cls: cls(str(tmp_path / "games.qgl"))))
+    game = runner.Game()
+    yield game
+    game.close()
+
+
+def test_game_over_after_ai_win_is_idle(game):
+    game.game_state = "select_piece"
+    # Pieces 0, 1 and 2 share their two high bits with piece 4, so the AI
+    # wins by placing 4 in the last cell of the top row
+    for col, piece in enumerate([0, 1, 2]):
+        game.board.place_piece(piece, 0, col)
+        game.available_pieces.remove(PIECES[piece])
+    game.select_piece(game.available_pieces.index(PIECES[4]))
+    game.is_ai_turn = True
+    game.game_state = "ai_thinking"
+    game.result = game.handle_ai_turn()
+    assert game.result == "Player 2 wins!"
+    assert game.game_state == "game_over"
+    assert not game.is_animating()
+    game.draw()
+
+
+def test_hovering_a_button_redraws_only_the_button(game):
+    def check(button):
+        game.draw()
+        before = pygame.image.tobytes(runner.screen, "RGB")
+        button.is_hovered = True
+        assert game.draw() == [button.rect.inflate(4, 4)]
+        button.is_hovered = False
+        assert game.draw() == [button.rect.inflate(4, 4)]
+        assert pygame.image.tobytes(runner.screen, "RGB") == before
+
+    check(game.start_button)
+    check(game.engine_button)
+    game.game_state = "game_over"
+    game.result = "It's a draw!"
+    check(game.restart_button)
+
+
+class _StubClient:
+    # Stands in for client.GameClient: answers new with the next session
+    def __init__(self):
+        self.pushed = queue.Queue()
+        self.sessions = 0
+
+    def request(self, op, **fields):
+        assert op == "new"
+        self.sessions += 1
+        return _state(self.sessions, "select_piece", [])
+
+    def poll(self):
+        state = None
+        while not self.pushed.empty():
+            state = self.pushed.get_nowait()
+        return state
+
+    def close(self):
+        pass
+
+
+def _state(session, state, cells):
+    return {'op': 'state', 'session': session, 'engine': "minimax", 'cells': cells + [None] * (16 - len(cells)),
+            'available': list(range(len(cells), 16)), 'selected': None, 'current_player': 1, 'state': state,
+            'result': None}
+
+
+def test_remote_game_ignores_states_pushed_before_a_reset(tmp_path, monkeypatch):
+    monkeypatch.setattr(GameLog, "open_default", classmethod(lambda cls: cls(str(tmp_path / "games.qgl"))))
+    client = _StubClient()
+    game = runner.RemoteGame(client)
+    try:
+        # The first game's AI move arrives after the player started over
+        client.pushed.put(_state(1, "place_piece", [0]))
+        game.reset_game()
+        game.game_state = "ai_thinking"
+        game.update_ai_turn()
+        assert game.board.filled == 0
+        client.pushed.put(_state(2, "place_piece", [0]))
+        game.update_ai_turn()
+        assert game.board.filled == 1 and game.game_state == "place_piece"
+    finally:
+        game.close()
@@ -0,0 +1,401 @@
+# Headless self-play tournament and engine benchmarks.
+#
+#   python tournament.py match minimax:time=0.1 random --games 1000 --json results.json
+#   python tournament.py bench --depth 3 --json bench.json
+#
+# An engine is given as name[:key=value,...]:
+#   minimax   depth=<plies> time=<seconds per move> endgame=<empty cells> book=1 cache=1
+#             trace=<JSON lines file> profile=cprofile|sample
+#             workers=<processes> splits each search across a process pool
+#   mcts      time=<seconds per move> iterations=<leaves> batch=<leaves> playouts=<per leaf>
+#   random    plays uniformly random legal moves
+# For mcts the reported nodes are playouts.
+# Games alternate which engine hands over the first piece and run across a
+# process pool. match reports win/draw/loss for the first engine with 95%
+# Wilson intervals, search speed and per-turn latency percentiles; bench
+# times fixed positions so speed regressions in the search and the rules
+# show up as numbers, along with the garbage collections and memory each
+# search costs.
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from Agent import QuartoAI
+from parallel import ParallelQuartoAI
+from book import OpeningBook
+from cache import ResultCache
+from engine import Board, NUM_CELLS, NUM_PIECES, cell_position
+from mcts import MCTSPlayer
+from profiling import PROFILE_MODES
+from tablebase import Tablebase
+
+# z for a 95% confidence interval
+_Z95 = 1.96
+
+
+class RandomPlayer:
+    def __init__(self, seed = None):
+        self.rng = random.Random(seed)
+        self.last_stats = None
+
+    def choose_piece(self, available_pieces, board = None):
+        return self.rng.choice(available_pieces)
+
+    def get_best_move(self, board, piece):
+        return cell_position(self.rng.choice(board.empty_cells()))
+
+
+def _positive(kind):
+    def check(value):
+        if kind(value) <= 0:
+            raise ValueError
+    return check
+
+
+def _choice(*values):
+    def check(value):
+        if value not in values:
+            raise ValueError
+    return check
+
+
+# The options of each engine, with a check that raises ValueError on a bad
+# value, so a bad spec fails when it is parsed rather than in a worker
+_ENGINE_OPTIONS = {
+    "minimax": {"depth": _positive(int), "time": _positive(float), "endgame": int, "book": _choice("0", "1"),
+                "cache": _choice("0", "1"), "trace": str, "profile": _choice(*PROFILE_MODES),
+                "workers": _positive(int)},
+    "mcts": {"time": _positive(float), "iterations": _positive(int), "batch": _positive(int),
+             "playouts": _positive(int)},
+    "random": {},
+}
+
+
+def parse_engine(spec):
+    # "minimax:depth=3,time=0.1" -> ("minimax", {"depth": "3", "time": "0.1"})
+    name, _, options = spec.partition(":")
+    if name not in _ENGINE_OPTIONS:
+        raise ValueError(f"unknown engine {name!r}")
+    settings = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition("=")
+        check = _ENGINE_OPTIONS[name].get(key)
+        if check is None:
+            raise ValueError(f"unknown {name} option {key!r}")
+        try:
+            check(value)
+        except ValueError:
+            raise ValueError(f"bad {name} option {key}={value!r}") from None
+        settings[key] = value
+    return name, settings
+
+
+def make_engine(spec, seed):
+    name, settings = parse_engine(spec)
+    if name == "random":
+        return RandomPlayer(seed)
+    if name == "mcts":
+        return MCTSPlayer(
+            iterations=int(settings["iterations"]) if "iterations" in settings else None,
+            time_budget=float(settings["time"]) if "time" in settings else None,
+            leaf_batch=int(settings.get("batch", 16)),
+            playouts_per_leaf=int(settings.get("playouts", 64)),
+            seed=seed)
+    time_budget = float(settings["time"]) if "time" in settings else None
+    # With only a time budget, deepen as far as it allows
+    depth = int(settings.get("depth", NUM_CELLS if time_budget is not None else 3))
+    endgame = int(settings["endgame"]) if "endgame" in settings else None
+    options = dict(
+        max_depth=depth, time_budget=time_budget, endgame_empties=endgame,
+        tablebase=Tablebase.open_default() if endgame is not None else None,
+        book=OpeningBook.open_default() if settings.get("book") == "1" else None,
+        cache=ResultCache.open_default() if settings.get("cache") == "1" else None,
+        trace=settings.get("trace"), profile=settings.get("profile"))
+    if "workers" in settings:
+        return ParallelQuartoAI(workers=int(settings["workers"]), **options)
+    return QuartoAI(**options)
+
+
+def close_engine(engine):
+    # Engines holding processes (ParallelQuartoAI) release them here
+    close = getattr(engine, "close", None)
+    if close is not None:
+        close()
+
+
+def play_game(specs, first, seed):
+    # One game between engines specs[0] and specs[1]; specs[first] hands over
+    # the first piece. Returns the winner's index (or None) and per-engine
+    # turn latencies, nodes and search time.
+    random.seed(seed)
+    engines = [make_engine(spec, seed * 2 + i) for i, spec in enumerate(specs)]
+    try:
+        return _play(specs, engines, first, seed)
+    finally:
+        for engine in engines:
+            close_engine(engine)
+
+
+def _play(specs, engines, first, seed):
+    latency = [[], []]
+    nodes = [0, 0]
+    search_time = [0.0, 0.0]
+
+    def timed(player, call, *args):
+        engine = engines[player]
+        engine.last_stats = None
+        start = time.perf_counter()
+        result = call(*args)
+        elapsed = time.perf_counter() - start
+        stats = engine.last_stats
+        if stats is not None:
+            nodes[player] += stats.get('nodes', stats.get('playouts', 0))
+            search_time[player] += stats['time']
+        return result, elapsed
+
+    board = Board()
+    available = list(range(NUM_PIECES))
+    piece, elapsed = timed(first, engines[first].choose_piece, list(available), board.copy())
+    latency[first].append(elapsed)
+    available.remove(piece)
+    player = 1 - first
+    winner = None
+    while True:
+        (row, col), place_time = timed(player, engines[player].get_best_move, board.copy(), piece)
+        if not board.place_piece(piece, row, col):
+            raise RuntimeError(f"{specs[player]} played an occupied cell {(row, col)}")
+        if board.check_win():
+            latency[player].append(place_time)
+            winner = player
+            break
+        if board.is_full():
+            latency[player].append(place_time)
+            break
+        piece, give_time = timed(player, engines[player].choose_piece, list(available), board.copy())
+        if piece not in available:
+            raise RuntimeError(f"{specs[player]} gave piece {piece}, which is not available")
+        latency[player].append(place_time + give_time)
+        available.remove(piece)
+        player = 1 - player
+    return {
+        'seed': seed,
+        'first': first,
+        'winner': winner,
+        'pieces': board.filled,
+        'latency': latency,
+        'nodes': nodes,
+        'search_time': search_time,
+    }
+
+
+def wilson_interval(successes, trials, z = _Z95):
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    half = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def percentile(values, q):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(specs, games):
+    total = len(games)
+    wins = sum(1 for game in games if game['winner'] == 0)
+    losses = sum(1 for game in games if game['winner'] == 1)
+    draws = total - wins - losses
+    summary = {'engines': specs, 'games': total, 'results': {}, 'engine_stats': []}
+    for label, count in (('win', wins), ('draw', draws), ('loss', losses)):
+        low, high = wilson_interval(count, total)
+        summary['results'][label] = {'count': count, 'rate': count / total if total else 0.0, 'ci95': [low, high]}
+    summary['score'] = (wins + draws / 2) / total if total else 0.0
+    for player, spec in enumerate(specs):
+        latencies = [t for game in games for t in game['latency'][player]]
+        nodes = sum(game['nodes'][player] for game in games)
+        search_time = sum(game['search_time'][player] for game in games)
+        summary['engine_stats'].append({
+            'engine': spec,
+            'nodes': nodes,
+            'nodes_per_sec': nodes / search_time if search_time > 0 else None,
+            'turns': len(latencies),
+            'latency_ms': {f"p{q}": percentile(latencies, q) * 1000 for q in (50, 95, 99)} if latencies else None,
+        })
+    return summary
+
+
+def print_summary(summary, elapsed):
+    specs = summary['engines']
+    print(f"{specs[0]} vs {specs[1]}: {summary['games']} games in {elapsed:.1f}s, "
+          f"score {summary['score']:.3f} for {specs[0]}")
+    for label, result in summary['results'].items():
+        low, high = result['ci95']
+        print(f"  {label:5s} {result['count']:6d}  {result['rate']:6.1%}  (95% CI {low:.1%} - {high:.1%})")
+    for stats in summary['engine_stats']:
+        speed = "-" if stats['nodes_per_sec'] is None else f"{stats['nodes_per_sec']:.0f}"
+        latency = stats['latency_ms']
+        if latency is None:
+            latency_text = "no turns"
+        else:
+            latency_text = f"p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f} ms"
+        print(f"  {stats['engine']:28s} nodes/s {speed:>9s}  turn latency {latency_text}")
+
+
+def match(specs, games, workers, seed, chunksize):
+    for spec in specs:
+        parse_engine(spec)
+    firsts = [game % 2 for game in range(games)]
+    seeds = [seed + game for game in range(games)]
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(play_game, [specs] * games, firsts, seeds, chunksize=chunksize))
+    elapsed = time.perf_counter() - start
+    summary = summarize(specs, results)
+    summary['time'] = elapsed
+    print_summary(summary, elapsed)
+    return summary, results
+
+
+# Fixed benchmark positions: (name, [(piece, cell), ...] placed in order,
+# piece in hand). Chosen for a spread of branching factors, not strength.
+BENCHMARK_POSITIONS = [
+    ("opening", [(0, 0)], 15),
+    ("early", [(0, 0), (5, 6), (10, 9)], 12),
+    ("middle", [(0, 0), (5, 6), (10, 9), (15, 12), (3, 1)], 6),
+    ("middle-threats", [(0, 0), (1, 1), (2, 2), (12, 5), (9, 10), (7, 15)], 13),
+    ("late", [(0, 0), (5, 6), (10, 9), (15, 12), (3, 1), (6, 4), (9, 14), (12, 11), (1, 7)], 8),
+    ("endgame", [(2, 0), (15, 1), (14, 4), (5, 5), (10, 6), (11, 7), (9, 8), (6, 9), (13, 10), (0, 11), (4, 15)], 3),
+]
+
+
+def benchmark_board(placements):
+    board = Board()
+    for piece, cell in placements:
+        board.place(piece, cell)
+    return board
+
+
+class GCTimer:
+    # Pause of every garbage collection while it is in gc.callbacks
+    def __init__(self):
+        self.pauses = []
+        self.started = None
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self.started = time.perf_counter()
+        elif self.started is not None:
+            self.pauses.append(time.perf_counter() - self.started)
+            self.started = None
+
+
+def bench(depth, rules_rounds):
+    results = {'depth': depth, 'search': [], 'rules': {}}
+    print(f"search at depth {depth}")
+    for name, placements, piece in BENCHMARK_POSITIONS:
+        board = benchmark_board(placements)
+        ai = QuartoAI(depth)
+        timer = GCTimer()
+        gc.callbacks.append(timer)
+        start = time.perf_counter()
+        try:
+            score, move = ai.search(board, piece)
+        finally:
+            elapsed = time.perf_counter() - start
+            gc.callbacks.remove(timer)
+        results['search'].append({'position': name, 'nodes': ai.nodes, 'time': elapsed,
+                                  'nodes_per_sec': ai.nodes / elapsed, 'score': score,
+                                  'gc_collections': len(timer.pauses), 'gc_pause_max': max(timer.pauses, default=0),
+                                  'gc_pause_total': sum(timer.pauses)})
+        print(f"  {name:15s} nodes {ai.nodes:9d}  {elapsed:7.3f}s  {ai.nodes / elapsed:9.0f} nodes/s  "
+              f"gc {len(timer.pauses):3d} (max {max(timer.pauses, default=0) * 1000:.1f} ms)")
+    total_nodes = sum(r['nodes'] for r in results['search'])
+    total_time = sum(r['time'] for r in results['search'])
+    results['nodes_per_sec'] = total_nodes / total_time
+    print(f"  {'total':15s} nodes {total_nodes:9d}  {total_time:7.3f}s  {total_nodes / total_time:9.0f} nodes/s  "
+          f"gc {sum(r['gc_collections'] for r in results['search']):3d} "
+          f"(max {max(r['gc_pause_max'] for r in results['search']) * 1000:.1f} ms)")
+
+    # Memory of the same searches, traced separately since tracing slows them
+    # down. What a search keeps is its transposition table entries; the peak
+    # above that is the garbage it made along the way.
+    print("memory")
+    for result, (name, placements, piece) in zip(results['search'], BENCHMARK_POSITIONS):
+        board = benchmark_board(placements)
+        ai = QuartoAI(depth)
+        tracemalloc.start()
+        try:
+            ai.search(board, piece)
+            kept, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['memory_kept'] = kept
+        result['memory_peak'] = peak
+        print(f"  {name:15s} kept {kept / 1024:9.1f} KiB  peak {peak / 1024:9.1f} KiB  "
+              f"{kept / max(ai.nodes, 1):6.1f} B/node kept")
+
+    # Rules primitives the search leans on, over the same positions
+    boards = [benchmark_board(placements) for _, placements, _ in BENCHMARK_POSITIONS]
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(rules_rounds):
+        for board in boards:
+            for cell in board.empty_cells():
+                board.place(board.remaining_pieces()[0], cell)
+                board.check_win()
+                board.undo()
+                calls += 1
+    place_rate = calls / (time.perf_counter() - start)
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(rules_rounds):
+        for board in boards:
+            for piece in range(NUM_PIECES):
+                board.winning_cell(piece)
+                calls += 1
+    winning_rate = calls / (time.perf_counter() - start)
+    results['rules'] = {'place_check_undo_per_sec': place_rate, 'winning_cell_per_sec': winning_rate}
+    print(f"place + check_win + undo {place_rate:12.0f}/s")
+    print(f"winning_cell             {winning_rate:12.0f}/s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Quarto tournaments and benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    match_parser = commands.add_parser("match", help="play two engines against each other")
+    match_parser.add_argument("engines", nargs=2, help="engine specs, e.g. minimax:depth=3 random")
+    match_parser.add_argument("--games", type=int, default=1000)
+    match_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    match_parser.add_argument("--seed", type=int, default=0)
+    match_parser.add_argument("--chunksize", type=int, default=8, help="games sent to a worker at a time")
+    match_parser.add_argument("--json", help="write the summary and every game to this file")
+    bench_parser = commands.add_parser("bench", help="time the search and rules on fixed positions")
+    bench_parser.add_argument("--depth", type=int, default=3)
+    bench_parser.add_argument("--rounds", type=int, default=2000, help="repetitions of the rules timings")
+    bench_parser.add_argument("--json", help="write the timings to this file")
+    args = parser.parse_args()
+
+    if args.command == "match":
+        summary, games = match(args.engines, args.games, args.workers, args.seed, args.chunksize)
+        output = dict(summary, game_results=games)
+    else:
+        output = bench(args.depth, args.rounds)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# Fixed-size transposition table for QuartoAI, keyed by canonical position
+# (see symmetry.canonical) so equivalent positions share one entry.
+
+EXACT = 0
+LOWER = 1   # score is a lower bound (the search failed high)
+UPPER = 2   # score is an upper bound (the search failed low)
+
+# Canonical keys are highly structured, so slots are picked from the high
+# bits of a multiplicative hash
+_MIX = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+
+
+class TranspositionTable:
+    def __init__(self, size=1 << 18):
+        # size is rounded up to a power of two
+        self.bits = max(1, (size - 1).bit_length())
+        self.size = 1 << self.bits
+        # Each slot holds (key, depth, flag, score, move, generation) or None
+        self.slots = [None] * self.size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+        self.rejected = 0
+
+    def new_search(self):
+        # Entries from older searches become the first candidates for eviction
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.generation = 0
+
+    def _index(self, key):
+        return ((hash(key) * _MIX) & _MASK64) >> (64 - self.bits)
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.slots[self._index(key)]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, move=None):
+        index = self._index(key)
+        entry = self.slots[index]
+        if entry is not None and entry[0] != key:
+            # Replacement policy: keep a deeper entry from the current search,
+            # otherwise evict it
+            if entry[5] == self.generation and entry[1] > depth:
+                self.rejected += 1
+                return
+            self.overwrites += 1
+        elif entry is not None and move is None:
+            # Keep the old best-move hint when the new result has none
+            move = entry[4]
+        self.slots[index] = (key, depth, flag, score, move, self.generation)
+        self.stores += 1
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'probes': self.probes,
+            'hits': self.hits,
+            'hit_rate': self.hits / self.probes if self.probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,58 @@
+# Runs QuartoAI off the pygame main loop so the window keeps drawing while
+# the AI thinks. A thread (not a process) is used so a running search can be
+# stopped through QuartoAI.stop() and keeps its tables between moves.
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+def think(ai, board, piece, available_pieces):
+    # One AI turn: place piece, then pick what to hand back. board and
+    # available_pieces must be copies the UI isn't drawing from.
+    row, col = ai.get_best_move(board, piece)
+    board.place_piece(piece, row, col)
+    give = None
+    if not board.check_win() and not board.is_full():
+        give = ai.choose_piece(available_pieces, board)
+    return row, col, give
+
+
+class AIWorker:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quarto-ai")
+        self.future = None
+        self.ai = None
+
+    def submit(self, ai, fn, *args):
+        # Start fn(*args) in the background; ai is what cancel() stops
+        self.cancel()
+        self.ai = ai
+        self.future = self.executor.submit(fn, *args)
+        return self.future
+
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+    def result(self):
+        # The finished result, or None while still running. Errors from the
+        # search are raised here, on the main thread.
+        if self.future is None or not self.future.done():
+            return None
+        future = self.future
+        self.future = None
+        return future.result()
+
+    def cancel(self):
+        # Drop the pending job; a search already running is told to stop and
+        # its result is ignored. Jobs run one at a time, so the stop is
+        # repeated until the job has ended: one that arrived just before its
+        # search started would be lost, and a pondering search only ends by
+        # itself once it has searched to the end of the game.
+        if self.future is not None and not self.future.cancel() and self.ai is not None:
+            while not self.future.done():
+                self.ai.stop()
+                wait([self.future], timeout=0.005)
+        self.future = None
+        self.ai = None
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)